@@ -101,8 +101,7 @@ class OwnerCMDs(commands.Cog, name="Owner", command_attrs=dict(hidden=True)):
         self.bot.config = {}
 
         self.bot.load_extension("cogs.db_handler")
-        while self.bot.config == {}:
-            await asyncio.sleep(0.1)
+        await self.bot.get_cog("DBHandler").ready.wait()
 
         for extension in extensions:
             if extension != "cogs.db_handler":
@@ -111,6 +110,43 @@ class OwnerCMDs(commands.Cog, name="Owner", command_attrs=dict(hidden=True)):
         self.bot.init_load = False
         await ctx.reply(f"Database reloaded!")
 
+    @commands.command(hidden=True, aliases=["migratereactortable"])
+    async def migrate_reactor_table(self, ctx):
+        db_handler = self.bot.get_cog("DBHandler")
+        if not db_handler:
+            raise utils.CustomCheckFailure("The database handler isn't loaded!")
+        if db_handler.reactor_table:
+            raise utils.CustomCheckFailure("Reactors are already stored in their own table!")
+
+        await db_handler.migrate_to_reactor_table()
+        await ctx.reply("Migrated reactors to their own table!")
+
+    @commands.command(hidden=True, aliases=["starboardstats"])
+    async def starboard_stats(self, ctx):
+        in_memory, known = self.bot.starboard.count()
+        lines = [f"Entries in memory: {in_memory}", f"Entries known: {known}"]
+
+        db_handler = self.bot.get_cog("DBHandler")
+        if db_handler:
+            # anything not flushed yet won't be in here
+            lines.append(f"Rows in the database: {await db_handler.count_rows('starboard')}")
+
+        await ctx.reply("\n".join(lines))
+
+    @commands.command(hidden=True)
+    async def metrics(self, ctx):
+        message_cache = self.bot.message_cache
+        lines = [f"Message cache: {len(message_cache)} messages, {message_cache.hits} hits, {message_cache.misses} misses",
+            f"Starboard refreshes: {len(self.bot.star_refresher.tasks)} pending, {self.bot.star_refresher.coalesced} coalesced"]
+
+        star_queue = self.bot.star_queue
+        average_wait = star_queue.total_wait / star_queue.processed if star_queue.processed else 0
+        lines.append(f"Starboard queue: {star_queue.qsize()} waiting, {star_queue.processed} processed, " +
+            f"{average_wait:.2f}s average wait, {star_queue.max_wait:.2f}s max wait")
+        lines.extend(f"{key}: {value}" for key, value in sorted(self.bot.metrics.items()))
+
+        await ctx.reply("\n".join(lines))
+
     @commands.command(hidden=True, aliases=["list_slash_commands", "listslashcmds"])
     async def list_slash_cmds(self, ctx, guild_id: typing.Optional[custom_classes.UsableIDConverter]):
         slash_cmds = await discord_slash.utils.manage_commands.get_all_commands(self.bot.user.id, self.bot.http.token, guild_id)
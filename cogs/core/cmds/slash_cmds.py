@@ -95,7 +95,7 @@ class SlashCMDS(commands.Cog):
         else:
             author_str = f"<@{ctx.author}>"
 
-        kill_msg = random.choice(self.bot.death_messages)
+        kill_msg = random.choice(await self.bot.death_messages.get())
 
         kill_msg = kill_msg.replace("%1$s", victim_str)
         kill_msg = kill_msg.replace("%2$s", author_str)
@@ -42,13 +42,12 @@ class EtcEvents(commands.Cog):
 
     @commands.Cog.listener()
     async def on_user_update(self, before, after):
-        for guild_id in self.bot.custom_cache.keys():
-            if self.bot.custom_cache[guild_id].get(after.id) != None:
-                guild = self.bot.get_guild(guild_id)
-                if guild:
-                    member = guild.get_member(after.id)
-                    if member:
-                        self.bot.update_member(member)
+        for guild_id in tuple(self.bot.get_user_guilds(after.id)):
+            guild = self.bot.get_guild(guild_id)
+            if guild:
+                member = guild.get_member(after.id)
+                if member:
+                    self.bot.update_member(member)
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
@@ -1,18 +1,61 @@
 #!/usr/bin/env python3.7
 from discord.ext import commands, tasks
 import discord, os, asyncio, importlib
-import copy, asyncpg, json
+import asyncpg, json, typing
+import collections
 
 import common.utils as utils
 import common.star_classes as star_classes
+import common.classes as custom_classes
 
 class DBHandler(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.pool: typing.Optional[asyncpg.pool.Pool] = None
+
+        # if true, reactors are stored in their own table, and only the reactors that changed are written
+        # this is worked out from the database itself in get_dbs, so it can't disagree with how the rows are stored
+        self.reactor_table = False
+
+        journal_path = os.environ.get("STARBOARD_JOURNAL_PATH", "starboard_journal")
+        self.journal = star_classes.StarboardJournal(journal_path)
+
+        # if set, guilds are only loaded once they're used, and at most this many entries are kept in memory
+        cache_size = os.environ.get("STARBOARD_CACHE_SIZE")
+        self.cache_size = int(cache_size) if cache_size else None
+
+        # set once the config and starboard have been loaded, so anything that needs them can wait on it
+        self.ready = asyncio.Event()
+
         self.commit_loop.start()
+        self.journal_loop.start()
 
     def cog_unload(self):
         self.commit_loop.cancel()
+        self.journal_loop.cancel()
+
+        if self.bot.starboard.journal == self.journal:
+            self.bot.starboard.journal = None
+        self.journal.close()
+
+        if self.bot.starboard.loader == self.load_guild_index:
+            self.bot.starboard.loader = None
+            self.bot.starboard.fetcher = None
+
+        if self.pool:
+            self.bot.loop.create_task(self.pool.close())
+
+    async def init_connection(self, conn: asyncpg.Connection):
+        # ran once for every new connection in the pool
+        await conn.set_type_codec('jsonb', encoder=discord.utils.to_json, decoder=json.loads, schema='pg_catalog')
+
+    async def get_pool(self) -> asyncpg.pool.Pool:
+        # makes the pool if it doesn't exist - connecting takes a while, so we want to reuse connections
+        if not self.pool:
+            db_url = os.environ.get("DB_URL")
+            self.pool = await asyncpg.create_pool(db_url, min_size=1, max_size=5, init=self.init_connection)
+
+        return self.pool
 
     def create_cmd(self, table, a_type, entry):
         cmd = {
@@ -23,52 +66,151 @@ class DBHandler(commands.Cog):
 
         return cmd
 
+    def starboard_query(self, where = ""):
+        # makes a query for starboard entries, getting their reactors from the reactor table if needed
+        if self.reactor_table:
+            return ("SELECT s.ori_mes_id, s.data, " + 
+                "coalesce((SELECT array_agg(r.user_id) FROM starboard_reactors r WHERE r.ori_mes_id = s.ori_mes_id AND r.kind = 1), '{}') AS ori_reactors, " +
+                "coalesce((SELECT array_agg(r.user_id) FROM starboard_reactors r WHERE r.ori_mes_id = s.ori_mes_id AND r.kind = 2), '{}') AS var_reactors " +
+                f"FROM starboard s {where}")
+        else:
+            return f"SELECT * FROM starboard s {where}"
+
+    def entry_from_row(self, row):
+        if self.reactor_table:
+            return star_classes.StarboardEntry.from_row(row, (row["ori_reactors"], row["var_reactors"]))
+        else:
+            return star_classes.StarboardEntry.from_row(row)
+
+    async def load_guild_index(self, guild_id):
+        # used by the starboard to index a guild's entries the first time they're needed
+        # only what the indexes need is selected - the reactors are counted here rather than sent over
+        if self.reactor_table:
+            stars = "(SELECT count(DISTINCT r.user_id) FROM starboard_reactors r WHERE r.ori_mes_id = s.ori_mes_id)"
+        else:
+            stars = "(SELECT count(DISTINCT r) FROM jsonb_array_elements_text((s.data->'ori_reactors') || (s.data->'var_reactors')) r)"
+
+        query = ("SELECT s.ori_mes_id, (s.data->>'author_id')::bigint AS author_id, " +
+            f"(s.data->>'star_var_id')::bigint AS star_var_id, {stars} AS stars " +
+            "FROM starboard s WHERE (s.data->>'guild_id')::bigint = $1")
+
+        async for rows in self.stream_query(query, guild_id):
+            for row in rows:
+                yield row["ori_mes_id"], row["author_id"], row["star_var_id"], row["stars"]
+
+    async def fetch_entry(self, ori_mes_id):
+        # used by the starboard to load an entry that was evicted
+        pool = await self.get_pool()
+
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(self.starboard_query("WHERE s.ori_mes_id = $1"), ori_mes_id)
+
+        return self.entry_from_row(row) if row else None
+
     async def get_dbs(self):
-        starboard_db = await self.fetch_table("starboard")
         config_db = await self.fetch_table("seraphim_config")
 
-        for row in starboard_db:
-            entry = star_classes.StarboardEntry.from_row(row)
-            self.bot.starboard.add(entry, init=True)
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            # the reactor table only exists once migrate_to_reactor_table has been ran
+            self.reactor_table = await conn.fetchval("SELECT to_regclass('starboard_reactors') IS NOT NULL")
+
+        if self.cache_size != None:
+            async with pool.acquire() as conn:
+                # makes loading a guild's entries not need to go through the whole table
+                await conn.execute("CREATE INDEX IF NOT EXISTS starboard_guild_id_idx ON starboard (((data->>'guild_id')::bigint))")
+
+            self.bot.starboard.loader = self.load_guild_index
+            self.bot.starboard.fetcher = self.fetch_entry
+            self.bot.starboard.max_entries = self.cache_size
+        else:
+            # the starboard table can be huge, so it's loaded in batches
+            # this way, both the rows and the entries aren't in memory at the same time
+            async for rows in self.stream_query(self.starboard_query()):
+                for row in rows:
+                    self.bot.starboard.add(self.entry_from_row(row), init=True)
+
+        # anything in the journal at this point was never flushed, likely due to a crash
+        await self.bot.starboard.replay(self.journal.read())
 
         config_dict = {}
         for row in config_db:
             config_dict[row["guild_id"]] = row["config"]
 
-        self.bot.config = config_dict
-        self.bot.config_bac = copy.deepcopy(config_dict)
+        self.bot.config = custom_classes.TrackedConfig(config_dict)
+
+    @tasks.loop(seconds=0.25)
+    async def journal_loop(self):
+        await self.journal.sync()
 
     @tasks.loop(minutes=2.5)
     async def commit_loop(self):
         list_of_cmds = []
+        popped_reactor_deltas = [] # so they can be put back if this fails
+
+        # everything before this segment will be in this flush
+        journal_segment = await self.journal.rotate()
 
         for entry_id in self.bot.starboard.added:
             entry = self.bot.starboard.get(entry_id)
             list_of_cmds.append(self.create_cmd("starboard", "INSERT INTO", entry))
+
+            entry.pop_reactor_deltas() # new entries have all of their reactors inserted anyways
+            if self.reactor_table:
+                for reactor in entry.get_all_reactors():
+                    list_of_cmds.append(self.create_cmd("starboard_reactors", "INSERT INTO", (entry_id,) + reactor))
+
         for entry_id in self.bot.starboard.updated:
             entry = self.bot.starboard.get(entry_id)
             list_of_cmds.append(self.create_cmd("starboard", "UPDATE", entry))
+
+            added_reactors, removed_reactors = entry.pop_reactor_deltas()
+            popped_reactor_deltas.append((entry, added_reactors, removed_reactors))
+            if self.reactor_table:
+                for reactor in added_reactors:
+                    list_of_cmds.append(self.create_cmd("starboard_reactors", "INSERT INTO", (entry_id,) + reactor))
+                for reactor in removed_reactors:
+                    list_of_cmds.append(self.create_cmd("starboard_reactors", "DELETE FROM", (entry_id,) + reactor))
+
         for entry_id in self.bot.starboard.removed:
             list_of_cmds.append(self.create_cmd("starboard", "DELETE FROM", entry_id))
 
+        starboard_added = self.bot.starboard.added
+        starboard_updated = self.bot.starboard.updated
+        starboard_removed = self.bot.starboard.removed
         self.bot.starboard.reset_deltas()
 
-        config = self.bot.config
-        config_bac = self.bot.config_bac
+        config: custom_classes.TrackedConfig = self.bot.config
+        config_added = config.added
+        config_updated = config.updated
+
+        for guild_id in config_added:
+            list_of_cmds.append(self.create_cmd("seraphim_config", "INSERT INTO", config[guild_id]))
+        for guild_id in config_updated:
+            list_of_cmds.append(self.create_cmd("seraphim_config", "UPDATE", config[guild_id]))
 
-        for guild in list(self.bot.config.keys()).copy():
-            if guild in list(config_bac.keys()):
-                if not config[guild] == config_bac[guild]:
-                    list_of_cmds.append(self.create_cmd("seraphim_config", "UPDATE", config[guild]))
-            else:
-                list_of_cmds.append(self.create_cmd("seraphim_config", "INSERT INTO", config[guild]))
+        config.reset_deltas()
 
         if list_of_cmds != []:
-            await self.run_commands(list_of_cmds)
+            try:
+                await self.run_commands(list_of_cmds)
+            except:
+                # everything gets tried again next time - the journal segments after the last good flush
+                # aren't truncated until then, so nothing is lost if we crash before that either
+                self.bot.starboard.restore_deltas(starboard_added, starboard_updated, starboard_removed)
+                for entry, added_reactors, removed_reactors in popped_reactor_deltas:
+                    entry.restore_reactor_deltas(added_reactors, removed_reactors)
+                config.added.update(config_added)
+                config.updated.update(config_updated - config.added)
+                raise
 
-            self.bot.config_bac = copy.deepcopy(self.bot.config)
+        self.journal.truncate(journal_segment)
+
+        # only entries that have been flushed can be evicted, so this is the best time to do it
+        self.bot.starboard.evict()
 
     @commit_loop.error
+    @journal_loop.error
     async def error_handle(self, *args):
         error = args[-1]
         await utils.error_handle(self.bot, error)
@@ -78,61 +220,107 @@ class DBHandler(commands.Cog):
         if self.bot.init_load:
             await self.get_dbs()
 
-            while self.bot.config == {}:
-                await asyncio.sleep(0.1)
+        self.bot.starboard.journal = self.journal
+        self.ready.set()
 
         await asyncio.sleep(60)
 
+    async def count_rows(self, table):
+        pool = await self.get_pool()
+
+        async with pool.acquire() as conn:
+            return await conn.fetchval(f"SELECT count(*) FROM {table}")
+
     async def fetch_table(self, table):
-        db_url = os.environ.get("DB_URL")
-        conn = await asyncpg.connect(db_url)
+        pool = await self.get_pool()
 
-        try:
-            await conn.set_type_codec('jsonb', encoder=discord.utils.to_json, decoder=json.loads, schema='pg_catalog')
+        async with pool.acquire() as conn:
             data = await conn.fetch(f"SELECT * FROM {table}")
-        finally:
-            await conn.close()
 
         return data
 
+    async def stream_query(self, query, *args, batch_size = 2000) -> typing.AsyncIterator[typing.List[asyncpg.Record]]:
+        # runs a query using a server-side cursor, yielding the rows in batches
+        # gives the event loop a chance to run between batches, so the bot's heartbeat doesn't get blocked
+        pool = await self.get_pool()
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                cursor = await conn.cursor(query, *args)
+
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+
+                    yield rows
+                    await asyncio.sleep(0)
+
+    async def migrate_to_reactor_table(self):
+        # moves the reactors out of the starboard table's data and into their own table
+        # everything is flushed first, so that the reactors copied are up to date
+        await self.commit_loop()
+
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""CREATE TABLE IF NOT EXISTS starboard_reactors(
+                    ori_mes_id bigint NOT NULL, user_id bigint NOT NULL, kind smallint NOT NULL,
+                    PRIMARY KEY (ori_mes_id, kind, user_id))""")
+
+                for type_of_reactor, key in ((star_classes.ReactorType.ORI_REACTORS, "ori_reactors"),
+                    (star_classes.ReactorType.VAR_REACTORS, "var_reactors")):
+                    await conn.execute(f"""INSERT INTO starboard_reactors(ori_mes_id, user_id, kind)
+                        SELECT ori_mes_id, jsonb_array_elements_text(data->'{key}')::bigint, {type_of_reactor.value}
+                        FROM starboard ON CONFLICT DO NOTHING""")
+
+                await conn.execute("UPDATE starboard SET data = data - 'ori_reactors' - 'var_reactors'")
+
+        self.reactor_table = True
+
     async def run_commands(self, commands):
-        db_url = os.environ.get("DB_URL")
-        conn = await asyncpg.connect(db_url)
+        # groups the commands by table and type, so that each group can be ran as one bulk statement
+        # instead of doing one round trip per command
+        grouped = collections.defaultdict(list)
+        for command in commands:
+            grouped[(command["table"], command["type"])].append(command["entry"])
+
+        config_inserts = [(c["guild_id_bac"], c) for c in grouped[("seraphim_config", "INSERT INTO")]]
+        config_updates = [(c["guild_id_bac"], c) for c in grouped[("seraphim_config", "UPDATE")]]
+        include_reactors = not self.reactor_table
+        star_inserts = [(e.ori_mes_id, e.to_dict(include_reactors)) for e in grouped[("starboard", "INSERT INTO")]]
+        star_updates = [(e.ori_mes_id, e.to_dict(include_reactors)) for e in grouped[("starboard", "UPDATE")]]
+        star_deletes = grouped[("starboard", "DELETE FROM")]
+        reactor_inserts = grouped[("starboard_reactors", "INSERT INTO")]
+        reactor_deletes = grouped[("starboard_reactors", "DELETE FROM")]
 
-        try:
-            await conn.set_type_codec('jsonb', encoder=discord.utils.to_json, decoder=json.loads, schema='pg_catalog')
+        pool = await self.get_pool()
 
+        async with pool.acquire() as conn:
             async with conn.transaction():
-                for command in commands:
-                    db_command = ""
-
-                    if command["table"] == "seraphim_config":
-                        if command["type"] == "INSERT INTO":
-                            db_command = ("INSERT INTO seraphim_config(guild_id, config) VALUES($1, $2)")
-                        elif command["type"] == "UPDATE":
-                            db_command = ("UPDATE seraphim_config SET config = $2 WHERE guild_id = $1")
-                        
-                        if db_command != "":
-                            await conn.execute(db_command, command["entry"]["guild_id_bac"], command["entry"])
-
-                    elif command["table"] == "starboard":
-                        if command["type"] == "DELETE FROM":
-                            await conn.execute("DELETE FROM starboard WHERE ori_mes_id = $1", command["entry"])
-                            continue
-                        elif command["type"] == "INSERT INTO":
-                            db_command = ("INSERT INTO starboard(ori_mes_id, data) VALUES($1, $2)")
-                        elif command["type"] == "UPDATE":
-                            db_command = ("UPDATE starboard SET data = $2 WHERE ori_mes_id = $1")
-
-                        if db_command != "":
-                            command["entry"].ori_reactors = list(command["entry"].ori_reactors)
-                            command["entry"].var_reactors = list(command["entry"].var_reactors)
-                            await conn.execute(db_command, command["entry"].ori_mes_id, command["entry"].to_dict())
-                            command["entry"].ori_reactors = set(command["entry"].ori_reactors)
-                            command["entry"].var_reactors = set(command["entry"].var_reactors)
-        finally:
-            await conn.close()
+                if config_inserts:
+                    await conn.executemany("INSERT INTO seraphim_config(guild_id, config) VALUES($1, $2)", config_inserts)
+                if config_updates:
+                    await conn.executemany("UPDATE seraphim_config SET config = $2 WHERE guild_id = $1", config_updates)
+
+                if star_inserts:
+                    await conn.executemany("INSERT INTO starboard(ori_mes_id, data) VALUES($1, $2)", star_inserts)
+                if star_updates:
+                    await conn.executemany("UPDATE starboard SET data = $2 WHERE ori_mes_id = $1", star_updates)
+                if star_deletes:
+                    await conn.execute("DELETE FROM starboard WHERE ori_mes_id = any($1::bigint[])", star_deletes)
+
+                if self.reactor_table:
+                    if reactor_deletes:
+                        await conn.executemany("DELETE FROM starboard_reactors WHERE ori_mes_id = $1 AND user_id = $2 AND kind = $3", 
+                            reactor_deletes)
+                    if reactor_inserts:
+                        await conn.executemany("INSERT INTO starboard_reactors(ori_mes_id, user_id, kind) VALUES($1, $2, $3) " + 
+                            "ON CONFLICT DO NOTHING", reactor_inserts)
+                    if star_deletes:
+                        await conn.execute("DELETE FROM starboard_reactors WHERE ori_mes_id = any($1::bigint[])", star_deletes)
     
 def setup(bot):
     importlib.reload(utils)
+    importlib.reload(custom_classes)
     bot.add_cog(DBHandler(bot))
\ No newline at end of file
@@ -9,47 +9,64 @@ class ClearEvents(commands.Cog):
         self.bot = bot
 
     async def auto_clear_stars(self, payload):
-        star_variant = self.bot.starboard.get(payload.message_id)
-        if star_variant:
-            star_utils.clear_stars(self.bot, star_variant, payload.message_id)
-            await star_utils.star_entry_refresh(self.bot, star_variant, payload.guild_id)
+        await self.bot.starboard.ensure_guild(payload.guild_id)
+        async with star_utils.entry_lock(self.bot, payload.message_id):
+            star_variant = await self.bot.starboard.fetch(payload.message_id, payload.guild_id)
+            if star_variant:
+                star_utils.clear_stars(self.bot, star_variant, payload.message_id)
+                star_utils.schedule_refresh(self.bot, star_variant, payload.guild_id)
 
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload):
+        self.bot.message_cache.discard(payload.message_id)
+
         if not star_utils.star_check(self.bot, payload):
             return
         
-        star_variant = self.bot.starboard.get(payload.message_id)
-
-        if star_variant:
-            if star_variant.star_var_id != payload.message_id:
-                self.bot.starboard.delete(star_variant.ori_mes_id)
-
-                if star_variant.star_var_id != None:
-                    star_chan = self.bot.get_channel(star_variant.starboard_id)
-                    if star_chan:
-                        try:
-                            star_mes = await star_chan.fetch_message(star_variant.star_var_id)
-                            await star_mes.delete()
-                            self.bot.star_queue.remove_from_copy((star_variant.ori_chan_id, star_variant.ori_mes_id, star_variant.guild_id))
-                        except discord.HTTPException:
-                            pass
-            else:
-                star_variant.star_var_id = None
-                star_variant.starboard_id = None
-                star_variant.forced = False
-                self.bot.starboard.update(star_variant)
+        await self.bot.starboard.ensure_guild(payload.guild_id)
+        async with star_utils.entry_lock(self.bot, payload.message_id):
+            star_variant = await self.bot.starboard.fetch(payload.message_id, payload.guild_id)
+
+            if star_variant:
+                if star_variant.star_var_id != payload.message_id:
+                    self.bot.starboard.delete(star_variant.ori_mes_id)
+
+                    if star_variant.star_var_id != None:
+                        star_chan = self.bot.get_channel(star_variant.starboard_id)
+                        if star_chan:
+                            try:
+                                star_mes = await star_chan.fetch_message(star_variant.star_var_id)
+                                await star_mes.delete()
+                                self.bot.star_queue.remove_from_copy((star_variant.ori_chan_id, star_variant.ori_mes_id, star_variant.guild_id))
+                            except discord.HTTPException:
+                                pass
+                else:
+                    star_variant.star_var_id = None
+                    star_variant.starboard_id = None
+                    star_variant.forced = False
+                    self.bot.starboard.update(star_variant)
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.bot.message_cache.discard(message_id)
+
         if not star_utils.star_check(self.bot, payload):
             return
 
-        init_star_variants = [self.bot.starboard.get(k) for k in payload.message_ids]
-        star_variants = [k for k in init_star_variants if k != None]
+        # the entries are found first, but rechecked once we have their locks, as they could have changed while waiting
+        entry_ids = []
+        for message_id in payload.message_ids:
+            star_variant = await self.bot.starboard.fetch(message_id, payload.guild_id)
+            if star_variant != None:
+                entry_ids.append(star_variant.ori_mes_id)
+
+        for entry_id in entry_ids:
+            async with self.bot.star_locks(entry_id):
+                star_variant = await self.bot.starboard.fetch(entry_id, payload.guild_id)
+                if star_variant == None:
+                    continue
 
-        if star_variants != []:
-            for star_variant in star_variants:
                 if not star_variant.star_var_id in payload.message_ids:
                     self.bot.starboard.delete(star_variant.ori_mes_id)
 
@@ -17,31 +17,23 @@ class StarCMDs(commands.Cog, name = "Starboard"):
     def __init__(self, bot):
         self.bot = bot
 
-    def get_star_rankings(self, ctx):
-        user_star_dict = collections.Counter()
-        guild_entries = self.bot.starboard.get_list(lambda e: e.guild_id == ctx.guild.id)
-
-        if guild_entries != []:
-            for entry in guild_entries:
-                if entry.author_id in user_star_dict.keys():
-                    user_star_dict[entry.author_id] += len(entry.get_reactors())
-                else:
-                    user_star_dict[entry.author_id] = len(entry.get_reactors())
-
-            return user_star_dict.most_common(None)
-        else:
-            return None
+    def get_star_rankings(self, ctx) -> typing.Optional[star_classes.StarRanking]:
+        return self.bot.starboard.get_author_rankings(ctx.guild.id)
 
-    def get_user_placing(self, user_star_list, author_id):
-        author_entry = discord.utils.find(lambda e: e[0] == author_id, user_star_list)
-        if author_entry != None:
-            author_index = user_star_list.index(author_entry)
-            return f"position: #{author_index + 1} with {author_entry[1]} ⭐"
+    def get_user_placing(self, user_star_rankings: star_classes.StarRanking, author_id):
+        author_rank = user_star_rankings.rank(author_id)
+        if author_rank != None:
+            return f"position: #{author_rank} with {user_star_rankings.scores[author_id]} ⭐"
         else:
             return "position: N/A - no stars found!"
     
     async def cog_check(self, ctx):
-        return self.bot.config[ctx.guild.id]["star_toggle"]
+        if not self.bot.config[ctx.guild.id]["star_toggle"]:
+            return False
+
+        # rankings and the like need all of the guild's entries to be there
+        await self.bot.starboard.ensure_guild(ctx.guild.id)
+        return True
 
     @groups.group(invoke_without_command=True, aliases = ["starboard", "star"], ignore_extra=False)
     async def sb(self, ctx):
@@ -87,30 +79,39 @@ class StarCMDs(commands.Cog, name = "Starboard"):
 
     @sb.command(aliases = ["msg_top", "msglb", "msg_lb"])
     @commands.cooldown(1, 5, commands.BucketType.member)
-    async def msgtop(self, ctx):
-        """Allows you to view the top 10 starred messages on a server. Cooldown of once every 5 seconds per user."""
+    async def msgtop(self, ctx, page: int = 1):
+        """Allows you to view the top 10 starred messages on a server. Cooldown of once every 5 seconds per user.
+        A page number can be given to view the messages after the top 10, 10 messages per page."""
+
+        if page < 1:
+            raise commands.BadArgument("The page number must be at least 1!")
+
+        message_rankings = self.bot.starboard.get_message_rankings(ctx.guild.id)
+        if message_rankings != None:
+            offset = (page - 1) * 10
+            top_entries = message_rankings.top(10, offset)
+            if top_entries == []:
+                raise commands.BadArgument(f"There are no starboard entries on page {page}!")
+
+            if page == 1:
+                top_title = f"Top starred messages in {ctx.guild.name}"
+            else:
+                top_title = f"Top starred messages in {ctx.guild.name} (page {page})"
 
-        guild_entries = self.bot.starboard.get_list(lambda e: e.guild_id == ctx.guild.id)
-        if guild_entries != []:
-            top_embed = discord.Embed(title=f"Top starred messages in {ctx.guild.name}", colour=discord.Colour(0xcfca76), timestamp=datetime.datetime.utcnow())
+            top_embed = discord.Embed(title=top_title, colour=discord.Colour(0xcfca76), timestamp=datetime.datetime.utcnow())
             top_embed.set_author(name=f"{self.bot.user.name}", icon_url=f"{str(ctx.guild.me.avatar_url_as(format=None,static_format='png', size=128))}")
             top_embed.set_footer(text="As of")
 
-            guild_entries.sort(reverse=True, key=lambda e: len(e.get_reactors()))
-
-            for i in range(len(guild_entries)):
-                if i > 9:
-                    break
-
-                entry = guild_entries[i]
+            for i in range(len(top_entries)):
+                entry = await self.bot.starboard.fetch(top_entries[i][0], ctx.guild.id)
                 starboard_id = entry.starboard_id
 
                 url = f"https://discordapp.com/channels/{ctx.guild.id}/{starboard_id}/{entry.star_var_id}"
-                num_stars = len(entry.get_reactors())
+                num_stars = top_entries[i][1]
                 member = await utils.user_from_id(self.bot, ctx.guild, entry.author_id)
                 author_str = f"{member.display_name} ({str(member)})" if member != None else f"User ID: {entry.author_id}"
 
-                top_embed.add_field(name=f"#{i+1}: {num_stars} ⭐ from {author_str}", value=f"[Message]({url})\n", inline=False)
+                top_embed.add_field(name=f"#{offset+i+1}: {num_stars} ⭐ from {author_str}", value=f"[Message]({url})\n", inline=False)
 
             await ctx.reply(embed=top_embed)
         else:
@@ -121,15 +122,14 @@ class StarCMDs(commands.Cog, name = "Starboard"):
     async def top(self, ctx):
         """Allows you to view the top 10 people with the most stars on a server. Cooldown of once every 5 seconds per user."""
 
-        user_star_list = self.get_star_rankings(ctx)
+        user_star_rankings = self.get_star_rankings(ctx)
 
-        if user_star_list != None:
+        if user_star_rankings != None:
             top_embed = discord.Embed(title=f"Star Leaderboard for {ctx.guild.name}", colour=discord.Colour(0xcfca76), timestamp=datetime.datetime.utcnow())
             top_embed.set_author(name=f"{self.bot.user.name}", icon_url=f"{str(ctx.guild.me.avatar_url_as(format=None,static_format='png', size=128))}")
 
+            user_star_list = user_star_rankings.top(10)
             for i in range(len(user_star_list)):
-                if i > 9:
-                    break
                 entry = user_star_list[i]
 
                 member = await utils.user_from_id(self.bot, ctx.guild, entry[0])
@@ -138,7 +138,7 @@ class StarCMDs(commands.Cog, name = "Starboard"):
 
                 top_embed.add_field(name=f"#{i+1}: {author_str}", value=f"{num_stars} ⭐\n", inline=False)
 
-            top_embed.set_footer(text=f"Your {self.get_user_placing(user_star_list, ctx.author.id)}")
+            top_embed.set_footer(text=f"Your {self.get_user_placing(user_star_rankings, ctx.author.id)}")
             await ctx.reply(embed=top_embed)
         else:
             raise utils.CustomCheckFailure("There are no starboard entries for this server!")
@@ -154,13 +154,13 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         else:
             member = ctx.author
 
-        user_star_list = self.get_star_rankings(ctx)
+        user_star_rankings = self.get_star_rankings(ctx)
 
-        if user_star_list != None:
+        if user_star_rankings != None:
             if user != None:
-                placing = f"{member.display_name}'s {self.get_user_placing(user_star_list, member.id)}"
+                placing = f"{member.display_name}'s {self.get_user_placing(user_star_rankings, member.id)}"
             else:
-                placing = f"Your {self.get_user_placing(user_star_list, member.id)}"
+                placing = f"Your {self.get_user_placing(user_star_rankings, member.id)}"
 
             place_embed = discord.Embed(colour=discord.Colour(0xcfca76), description=placing, timestamp=datetime.datetime.utcnow())
             place_embed.set_author(name=f"{self.bot.user.name}", icon_url=f"{str(ctx.guild.me.avatar_url_as(format=None,static_format='png',size=128))}")
@@ -176,19 +176,37 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         """Gets a random starboard entry from the server it's being run in.
         May not work 100% of the time, but it should be reliable enough."""
 
-        valid_entries = self.bot.starboard.get_list(lambda e: e.guild_id == ctx.guild.id and e.star_var_id != None)
+        num_posted = self.bot.starboard.count_posted(ctx.guild.id)
+
+        if num_posted:
+            star_mes = None
+            tried_ids = set()
+
+            # if the message picked can't be fetched, just try picking another one
+            # picking one we already tried doesn't count, but we don't want to keep picking forever either
+            max_tries = min(num_posted, 3)
+            for _ in range(max_tries * 10):
+                if len(tried_ids) >= max_tries:
+                    break
+
+                random_entry = await self.bot.starboard.fetch_random_posted(ctx.guild.id)
+                if random_entry == None: # all of them were removed while we were fetching
+                    raise utils.CustomCheckFailure("There are no starboard entries for me to pick!")
+                if random_entry.ori_mes_id in tried_ids:
+                    continue
+                tried_ids.add(random_entry.ori_mes_id)
 
-        if valid_entries:
-            random_entry = random.choice(valid_entries)
-            starboard_id = random_entry.starboard_id
+                starboard_chan = ctx.guild.get_channel(random_entry.starboard_id)
+                if starboard_chan == None:
+                    continue
 
-            starboard_chan = ctx.guild.get_channel(starboard_id)
-            if starboard_chan == None:
-                raise utils.CustomCheckFailure("I couldn't find the starboard channel for the entry I picked.")
+                try:
+                    star_mes = await starboard_chan.fetch_message(random_entry.star_var_id)
+                    break
+                except discord.HTTPException:
+                    continue
 
-            try:
-                star_mes = await starboard_chan.fetch_message(random_entry.star_var_id)
-            except discord.HTTPException:
+            if star_mes == None:
                 ori_url = f"https://discordapp.com/channels/{ctx.guild.id}/{random_entry.ori_chan_id}/{random_entry.ori_mes_id}"
                 raise utils.CustomCheckFailure("I picked an entry, but I couldn't get the starboard message.\n" +
                 f"This might be the message I was trying to get: {ori_url}")
@@ -210,7 +228,7 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         The message can either be the original message or the starboard variant message."""
 
         msg_id = msg.id if isinstance(msg, discord.Message) else msg
-        starboard_entry: star_classes.StarboardEntry = self.bot.starboard.get(msg_id)
+        starboard_entry: star_classes.StarboardEntry = await self.bot.starboard.fetch(msg_id, ctx.guild.id)
 
         if not starboard_entry or starboard_entry.guild_id != ctx.guild.id:
             raise commands.BadArgument("This message does not have an entry here internally.")
@@ -228,7 +246,7 @@ class StarCMDs(commands.Cog, name = "Starboard"):
             f"**Original Author:** <@{starboard_entry.author_id}>",
             f"**Original Message Link:** [Here!]({ori_url})",
             "",
-            f"**Total Stars:** {len(starboard_entry.get_reactors())}",
+            f"**Total Stars:** {starboard_entry.unique_stars}",
             f"**Stars on Original Message:** {len(starboard_entry.ori_reactors)}",
             f"**Stars on Starred Varient:** {len(starboard_entry.var_reactors)}",
             "",
@@ -252,7 +270,7 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         The message can either be the original message or the starboard variant message."""
 
         msg_id = msg.id if isinstance(msg, discord.Message) else msg
-        starboard_entry: star_classes.StarboardEntry = self.bot.starboard.get(msg_id)
+        starboard_entry: star_classes.StarboardEntry = await self.bot.starboard.fetch(msg_id, ctx.guild.id)
 
         if not starboard_entry or starboard_entry.guild_id != ctx.guild.id:
             raise commands.BadArgument("This message does not have an entry here internally.")
@@ -269,6 +287,11 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         await ctx.reply(embed=star_embed)
 
 
+    def entry_lock(self, msg):
+        # the lock for the entry of the message, so that commands don't change it at the same time as reactions and such
+        msg_id = msg if isinstance(msg, int) else msg.id
+        return star_utils.entry_lock(self.bot, msg_id)
+
     async def initial_get(self, ctx, msg, forced=False, do_not_create = False) -> star_classes.StarboardEntry:
         if not ctx.bot.config[ctx.guild.id]["star_toggle"]:
             raise utils.CustomCheckFailure("Starboard is not turned on for this server!")
@@ -280,7 +303,7 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         else:
             msg_id = msg.id
 
-        starboard_entry = ctx.bot.starboard.get(msg_id)
+        starboard_entry = await ctx.bot.starboard.fetch(msg_id, ctx.guild.id)
         if not starboard_entry:
             if not do_not_create:
                 author_id = star_utils.get_author_id(msg, ctx.bot)
@@ -302,15 +325,17 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         This message cannot be taken off the starboard unless it is deleted from it manually.
         You must have Manage Server permissions or higher to run this command."""
 
-        starboard_entry = await self.initial_get(self, ctx, msg, forced=True)
+        async with self.entry_lock(msg):
+            starboard_entry = await self.initial_get(ctx, msg, forced=True)
         
-        if not starboard_entry.star_var_id:
-            starboard_entry.forced = True
-            self.bot.starboard.update(starboard_entry)
-        else:
-            raise commands.BadArgument("This message is already on the starboard!")
+            if not starboard_entry.star_var_id:
+                starboard_entry.forced = True
+                self.bot.starboard.update(starboard_entry)
+            else:
+                raise commands.BadArgument("This message is already on the starboard!")
         
-        self.bot.star_queue.put_nowait((msg.channel.id, msg.id, msg.guild.id))
+            self.bot.star_queue.put_nowait((msg.channel.id, msg.id, msg.guild.id))
+
         await ctx.reply("Done! Please wait a couple of seconds for the message to appear.")
 
     @sb.command()
@@ -321,12 +346,13 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         a {channel id}-{message id} format, or the message link itself.
         You must have Manage Server permissions or higher to run this command."""
 
-        starboard_entry = await self.initial_get(ctx, msg)
-        starboard_entry.frozen = True
-        starboard_entry.updated = False
-        self.bot.starboard.update(starboard_entry)
-        if starboard_entry.star_var_id:
-            await star_utils.star_entry_refresh(self.bot, starboard_entry, ctx.guild.id)
+        async with self.entry_lock(msg):
+            starboard_entry = await self.initial_get(ctx, msg)
+            starboard_entry.frozen = True
+            starboard_entry.updated = False
+            self.bot.starboard.update(starboard_entry)
+            if starboard_entry.star_var_id:
+                await star_utils.star_entry_refresh(self.bot, starboard_entry, ctx.guild.id)
 
         await ctx.reply("The message's star count has been frozen.")
 
@@ -339,24 +365,25 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         a {channel id}-{message id} format, or the message link itself.
         You must have Manage Server permissions or higher to run this command."""
 
-        starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
-
-        if starboard_entry.star_var_id:
-            starboard_entry.trashed = True
-            starboard_entry.var_reactors = set()
-            starboard_entry.updated = False
-            self.bot.starboard.update(starboard_entry)
-
-            chan = self.bot.get_channel(starboard_entry.starboard_id)
-            if chan:
-                try:
-                    mes = await chan.fetch_message(starboard_entry.star_var_id)
-                    await mes.delete()
-                    self.bot.star_queue.remove_from_copy((starboard_entry.ori_chan_id, starboard_entry.ori_mes_id, starboard_entry.guild_id))
-                except discord.HTTPException:
-                    pass
-        else:
-            raise commands.BadArgument("That message is not on the starboard!")
+        async with self.entry_lock(msg):
+            starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
+
+            if starboard_entry.star_var_id:
+                starboard_entry.trashed = True
+                starboard_entry.set_reactors_of_type(star_classes.ReactorType.VAR_REACTORS, set())
+                starboard_entry.updated = False
+                self.bot.starboard.update(starboard_entry)
+
+                chan = self.bot.get_channel(starboard_entry.starboard_id)
+                if chan:
+                    try:
+                        mes = await chan.fetch_message(starboard_entry.star_var_id)
+                        await mes.delete()
+                        self.bot.star_queue.remove_from_copy((starboard_entry.ori_chan_id, starboard_entry.ori_mes_id, starboard_entry.guild_id))
+                    except discord.HTTPException:
+                        pass
+            else:
+                raise commands.BadArgument("That message is not on the starboard!")
 
         await ctx.reply("The message has been trashed.")
 
@@ -368,15 +395,16 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         a {channel id}-{message id} format, or the message link itself.
         You must have Manage Server permissions or higher to run this command."""
 
-        starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
-        if not starboard_entry.frozen:
-            raise commands.BadArgument("This message is not frozen.")
+        async with self.entry_lock(msg):
+            starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
+            if not starboard_entry.frozen:
+                raise commands.BadArgument("This message is not frozen.")
 
-        starboard_entry.frozen = False
-        starboard_entry.updated = False
-        self.bot.starboard.update(starboard_entry)
-        if starboard_entry.star_var_id:
-            await star_utils.star_entry_refresh(self.bot, starboard_entry, ctx.guild.id)
+            starboard_entry.frozen = False
+            starboard_entry.updated = False
+            self.bot.starboard.update(starboard_entry)
+            if starboard_entry.star_var_id:
+                await star_utils.star_entry_refresh(self.bot, starboard_entry, ctx.guild.id)
 
         await ctx.reply("The message's star count has been unfrozen.")
 
@@ -388,13 +416,14 @@ class StarCMDs(commands.Cog, name = "Starboard"):
         a {channel id}-{message id} format, or the message link itself.
         You must have Manage Server permissions or higher to run this command."""
 
-        starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
-        if not starboard_entry.trashed:
-            raise commands.BadArgument("This message is not trashed.")
+        async with self.entry_lock(msg):
+            starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
+            if not starboard_entry.trashed:
+                raise commands.BadArgument("This message is not trashed.")
 
-        starboard_entry.trashed = False
-        starboard_entry.updated = False
-        self.bot.starboard.update(starboard_entry)
+            starboard_entry.trashed = False
+            starboard_entry.updated = False
+            self.bot.starboard.update(starboard_entry)
 
         await ctx.reply("The message has been untrashed.")
 
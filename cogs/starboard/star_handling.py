@@ -1,6 +1,6 @@
 #!/usr/bin/env python3.7
 from discord.ext import commands
-import discord, importlib
+import discord, importlib, os, asyncio
 
 import common.utils as utils
 import common.star_utils as star_utils
@@ -9,35 +9,100 @@ import common.star_mes_handler as star_mes
 class Star(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.star_task = bot.loop.create_task(self.starboard_queue())
+
+        # several workers, so one slow post doesn't hold up every other one
+        num_workers = int(os.environ.get("STAR_QUEUE_WORKERS", 4))
+        self.star_tasks = [bot.loop.create_task(self.starboard_queue()) for _ in range(num_workers)]
 
     def cog_unload(self):
-        self.star_task.cancel()
+        for star_task in self.star_tasks:
+            star_task.cancel()
 
     async def starboard_queue(self):
         while True:
             entry = await self.bot.star_queue.get()
 
-            chan = self.bot.get_channel(entry[0])
-            starboard_entry = self.bot.starboard.get(entry[1])
+            try:
+                chan = self.bot.get_channel(entry[0])
 
-            # if the channel and the entry for the message exists in the bot and if the entry is above or at the required amount
-            # for that server
-            if chan and starboard_entry and (len(starboard_entry.get_reactors()) >= self.bot.config[entry[2]]["star_limit"]
-            or starboard_entry.forced):
-                try:
-                    mes = await chan.fetch_message(entry[1])
-                    await star_mes.send(self.bot, mes)
-                except discord.HTTPException: # you never know
-                    pass
+                async with self.bot.star_locks(entry[1]):
+                    starboard_entry = await self.bot.starboard.fetch(entry[1], entry[2])
 
-            self.bot.star_queue.task_done()
+                    # if the channel and the entry for the message exists in the bot and if the entry is above or at the required amount
+                    # for that server. also checks if it hasn't been sent already, as it might have been while we were waiting
+                    if chan and starboard_entry and not starboard_entry.star_var_id and (starboard_entry.unique_stars >= self.bot.config[entry[2]]["star_limit"]
+                    or starboard_entry.forced):
+                        try:
+                            mes = await utils.fetch_message(self.bot, chan, entry[1])
+                            await star_mes.send(self.bot, mes)
+                        except discord.HTTPException: # you never know
+                            pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # one bad entry shouldn't kill the worker
+                await utils.error_handle(self.bot, e)
+            finally:
+                self.bot.star_queue.task_done()
+
+    def skip_reaction(self, payload):
+        # marks a reaction as one we can ignore without fetching anything
+        # fetching the message is the main api call we'd do, so we count that as being avoided if it isn't cached
+        self.bot.metrics["star_reactions_skipped"] += 1
+        if not payload.message_id in self.bot.message_cache:
+            self.bot.metrics["rest_calls_avoided"] += 1
+
+    async def can_skip_add(self, payload):
+        # checks everything we can without the message to see if this reaction could even do anything
+        guild_config = self.bot.config[payload.guild_id]
+
+        if (payload.member and payload.member.bot) or payload.channel_id in guild_config["star_blacklist"]:
+            return True
+
+        if guild_config["remove_reaction"]:
+            # we'd need the message to know if the author reacted
+            return False
+
+        starboard_entry = await self.bot.starboard.fetch(payload.message_id, payload.guild_id)
+        if starboard_entry:
+            if starboard_entry.frozen or starboard_entry.trashed:
+                return True
+            # already counted, and the reactors have been synced - adding it again won't change a thing
+            return starboard_entry.updated and starboard_entry.check_reactor(payload.user_id)
+        else:
+            # messages in the starboard can't be starred unless they're star variants
+            return payload.channel_id == guild_config["starboard_id"]
+
+    async def can_skip_remove(self, payload):
+        guild_config = self.bot.config[payload.guild_id]
+
+        if payload.channel_id in guild_config["star_blacklist"]:
+            return True
+
+        guild = self.bot.get_guild(payload.guild_id)
+        member = guild.get_member(payload.user_id) if guild else None
+        if member and member.bot:
+            return True
+
+        starboard_entry = await self.bot.starboard.fetch(payload.message_id, payload.guild_id)
+        return (not starboard_entry or starboard_entry.frozen or starboard_entry.trashed
+            or (starboard_entry.updated and not starboard_entry.check_reactor(payload.user_id)))
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
         if not (star_utils.star_check(self.bot, payload) and str(payload.emoji) == "⭐"):
             return
 
+        # reactions on the same entry have to be handled one at a time, or they could overwrite each other
+        await self.bot.starboard.ensure_guild(payload.guild_id)
+        async with star_utils.entry_lock(self.bot, payload.message_id):
+            await self.reaction_add(payload)
+
+    async def reaction_add(self, payload):
+        if await self.can_skip_add(payload):
+            self.skip_reaction(payload)
+            return
+
         try:
             user, channel, mes = await utils.fetch_needed(self.bot, payload)
         except discord.Forbidden:
@@ -49,7 +114,7 @@ class Star(commands.Cog):
         if (not user.bot and not channel.id in self.bot.config[mes.guild.id]["star_blacklist"]):
 
             if mes.author.id != user.id:
-                starboard_entry = self.bot.starboard.get(mes.id)
+                starboard_entry = await self.bot.starboard.fetch(mes.id, mes.guild.id)
 
                 if starboard_entry and (starboard_entry.frozen or starboard_entry.trashed):
                     return
@@ -57,25 +122,25 @@ class Star(commands.Cog):
                 if not starboard_entry or not starboard_entry.star_var_id:
                     if channel.id != self.bot.config[mes.guild.id]["starboard_id"]:
                         await star_utils.modify_stars(self.bot, mes, payload.user_id, "ADD")
-                        starboard_entry = self.bot.starboard.get(mes.id)
+                        starboard_entry = await self.bot.starboard.fetch(mes.id, mes.guild.id)
                         if not starboard_entry:
                             return
 
-                        unique_stars = len(starboard_entry.get_reactors())
+                        unique_stars = starboard_entry.unique_stars
 
                         if unique_stars >= self.bot.config[mes.guild.id]["star_limit"]:
                             # the queue is infinite, so we should be good there
                             self.bot.star_queue.put_nowait((mes.channel.id, mes.id, mes.guild.id))
                                 
                 elif user.id != starboard_entry.author_id:
-                    old_stars = len(starboard_entry.get_reactors())
+                    old_stars = starboard_entry.unique_stars
 
                     await star_utils.modify_stars(self.bot, mes, payload.user_id, "ADD")
 
-                    new_entry = self.bot.starboard.get(mes.id)
-                    new_stars = len(new_entry.get_reactors())
+                    new_entry = await self.bot.starboard.fetch(mes.id, mes.guild.id)
+                    new_stars = new_entry.unique_stars
                     if old_stars != new_stars: # we don't want to refresh too often
-                        await star_utils.star_entry_refresh(self.bot, starboard_entry, mes.guild.id)
+                        star_utils.schedule_refresh(self.bot, starboard_entry, mes.guild.id)
 
             elif self.bot.config[mes.guild.id]["remove_reaction"]:
                 # the previous if confirms this is the author who is reaction (simply by elimination), so...
@@ -91,6 +156,15 @@ class Star(commands.Cog):
     async def on_raw_reaction_remove(self, payload):
         if not (star_utils.star_check(self.bot, payload) and str(payload.emoji) == "⭐"):
             return
+
+        await self.bot.starboard.ensure_guild(payload.guild_id)
+        async with star_utils.entry_lock(self.bot, payload.message_id):
+            await self.reaction_remove(payload)
+
+    async def reaction_remove(self, payload):
+        if await self.can_skip_remove(payload):
+            self.skip_reaction(payload)
+            return
             
         try:
             user, channel, mes = await utils.fetch_needed(self.bot, payload)
@@ -102,13 +176,13 @@ class Star(commands.Cog):
         if (not user.bot and mes.author.id != user.id
             and not channel.id in self.bot.config[mes.guild.id]["star_blacklist"]):
 
-            star_variant = self.bot.starboard.get(mes.id)
+            star_variant = await self.bot.starboard.fetch(mes.id, mes.guild.id)
 
             if star_variant and not (star_variant.frozen or star_variant.trashed):
                 await star_utils.modify_stars(self.bot, mes, payload.user_id, "SUBTRACT")
 
                 if star_variant.star_var_id:
-                    await star_utils.star_entry_refresh(self.bot, star_variant, mes.guild.id)
+                    star_utils.schedule_refresh(self.bot, star_variant, mes.guild.id)
 
     
     @commands.Cog.listener()
@@ -121,6 +195,8 @@ class Star(commands.Cog):
         # The best I can do is see if the raw data has the content in it, and just assume if it does,
         # that it means that it's a valid edit.
 
+        self.bot.message_cache.discard(payload.message_id)
+
         if payload.data.get("content") != None:
             # So we passed that initial check, but now we actually need the message
             # (we could use the raw data, but better safe than sorry). Sometimes we might not
@@ -131,13 +207,13 @@ class Star(commands.Cog):
                 chan = self.bot.get_channel(payload.channel_id)
                 if chan:
                     try:
-                        mes = await chan.fetch_message(payload.message_id)
+                        mes = await utils.fetch_message(self.bot, chan, payload.message_id)
                     except discord.HTTPException:
                         pass
             
             # if message exists and the edit message toggle is on
             if mes and self.bot.config[mes.guild.id]['star_edit_messages']:
-                starboard_entry = self.bot.starboard.get(mes.id, check_for_var = True)
+                starboard_entry = await self.bot.starboard.fetch(mes.id, mes.guild.id, check_for_var = True)
 
                 # if the starboard entry exists and the star variant of the entry is not the message edited
                 if starboard_entry and starboard_entry.star_var_id != mes.id:
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3.7
 from discord.ext import commands
 import discord, re, datetime
-import asyncio, typing
+import asyncio, typing, os, collections
+import aiohttp, logging, time
 
 class SnipedMessage():
     """A special class for sniped messages, using slots to keep the memory usage to a minimum."""
@@ -22,19 +23,445 @@ class UsableIDConverter(commands.IDConverter):
 
 class SetAsyncQueue(asyncio.Queue):
     """A special type of async queue that uses a set instead of a queue.
-    Useful when we don't want duplicates."""
+    Useful when we don't want duplicates.
+    If group_key is given, items are split into groups with it, and the groups take turns being taken from.
+    This way, one group with a lot of items can't hold up the others."""
+    def __init__(self, maxsize = 0, *, group_key = None, **kwargs):
+        self._group_key = group_key
+        super().__init__(maxsize, **kwargs)
+
     def _init(self, maxsize):
-        self._queue = set()
+        self._queue = collections.OrderedDict() # group -> dict of item -> time it was put in
         self._queuecopy = set()
+        self._size = 0
+
+        # for metrics
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.processed = 0
+
+    def qsize(self):
+        return self._size
+
     def _get(self):
-        return self._queue.pop()
+        group, items = next(iter(self._queue.items()))
+        item = next(iter(items))
+        put_time = items.pop(item)
+
+        if items:
+            self._queue.move_to_end(group) # gives the other groups their turn
+        else:
+            del self._queue[group]
+        self._size -= 1
+
+        wait = time.monotonic() - put_time
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.processed += 1
+
+        return item
+
     def _put(self, item):
         if not item in self._queuecopy:
-            self._queue.add(item)
+            group = self._group_key(item) if self._group_key else None
+            self._queue.setdefault(group, {})[item] = time.monotonic()
             self._queuecopy.add(item)
+            self._size += 1
+
     def remove_from_copy(self, item):
         self._queuecopy.discard(item)
 
+def track_config_value(value, config, guild_id):
+    """Converts dicts and lists (and any inside them) into their tracked versions,
+    so that changes to them mark the guild's config as updated."""
+    if isinstance(value, dict):
+        tracked = TrackedDict(config, guild_id)
+        for key, item in value.items():
+            dict.__setitem__(tracked, key, track_config_value(item, config, guild_id))
+        return tracked
+    elif isinstance(value, list):
+        return TrackedList(config, guild_id, (track_config_value(i, config, guild_id) for i in value))
+    else:
+        return value
+
+class TrackedDict(dict):
+    """A dict inside a guild's config. Marks that guild as updated whenever it's changed."""
+    __slots__ = ("_config", "_guild_id")
+
+    def __init__(self, config, guild_id):
+        super().__init__()
+        self._config = config
+        self._guild_id = guild_id
+
+    def _track(self, value):
+        return track_config_value(value, self._config, self._guild_id)
+
+    def _mark(self):
+        self._config.mark_updated(self._guild_id)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._track(value))
+        self._mark()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._mark()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._mark()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._mark()
+        return result
+
+    def setdefault(self, key, default = None):
+        if not key in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, self._track(value))
+        self._mark()
+
+    def clear(self):
+        super().clear()
+        self._mark()
+
+class TrackedList(list):
+    """A list inside a guild's config. Marks that guild as updated whenever it's changed."""
+    __slots__ = ("_config", "_guild_id")
+
+    def __init__(self, config, guild_id, items = ()):
+        super().__init__(items)
+        self._config = config
+        self._guild_id = guild_id
+
+    def _track(self, value):
+        return track_config_value(value, self._config, self._guild_id)
+
+    def _mark(self):
+        self._config.mark_updated(self._guild_id)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            super().__setitem__(index, [self._track(v) for v in value])
+        else:
+            super().__setitem__(index, self._track(value))
+        self._mark()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._mark()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def append(self, value):
+        super().append(self._track(value))
+        self._mark()
+
+    def extend(self, values):
+        super().extend(self._track(v) for v in values)
+        self._mark()
+
+    def insert(self, index, value):
+        super().insert(index, self._track(value))
+        self._mark()
+
+    def remove(self, value):
+        super().remove(value)
+        self._mark()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._mark()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._mark()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._mark()
+
+    def reverse(self):
+        super().reverse()
+        self._mark()
+
+class TrackedConfig(dict):
+    """A dict of guild IDs to their configs that keeps track of which guilds were added or changed.
+    This way, only those guilds need to be written to the database."""
+    __slots__ = ("added", "updated")
+
+    def __init__(self, configs = None):
+        super().__init__()
+        self.added = set()
+        self.updated = set()
+
+        if configs:
+            for guild_id, config in configs.items():
+                super().__setitem__(guild_id, track_config_value(config, self, guild_id))
+
+    def mark_updated(self, guild_id):
+        if not guild_id in self.added:
+            self.updated.add(guild_id)
+
+    def reset_deltas(self):
+        """Resets the deltas so that they have nothing."""
+        self.added = set()
+        self.updated = set()
+
+    def __setitem__(self, guild_id, config):
+        if guild_id in self:
+            self.mark_updated(guild_id)
+        else:
+            self.added.add(guild_id)
+
+        super().__setitem__(guild_id, track_config_value(config, self, guild_id))
+
+    def __delitem__(self, guild_id):
+        super().__delitem__(guild_id)
+        self.added.discard(guild_id)
+        self.updated.discard(guild_id)
+
+class MemberSnapshot():
+    """The bits of a member that are needed to rebuild it after a disconnect.
+    Much smaller than a full member object, and the role list and user are shared with the member it came from."""
+    __slots__ = ("id", "role_ids", "nick", "joined_at", "premium_since", "user")
+
+    def __init__(self, member: discord.Member):
+        self.id = member.id
+        self.role_ids = member._roles # never changed in place by discord.py, only replaced, so sharing it is safe
+        self.nick = member.nick
+        self.joined_at = member.joined_at
+        self.premium_since = member.premium_since
+        self.user = member._user
+
+    def to_member(self, guild: discord.Guild) -> discord.Member:
+        """Rebuilds a member for the guild specified from this snapshot."""
+        data = {
+            "user": {
+                "id": self.user.id,
+                "username": self.user.name,
+                "discriminator": self.user.discriminator,
+                "avatar": self.user.avatar,
+                "bot": self.user.bot
+            },
+            "roles": self.role_ids,
+            "nick": self.nick
+        }
+
+        member = discord.Member(data=data, guild=guild, state=guild._state)
+        member._user = self.user
+        member.joined_at = self.joined_at
+        member.premium_since = self.premium_since
+        return member
+
+class KeyedLock():
+    """A set of asyncio locks, one per key, made when needed and thrown away once nothing is using them.
+    Use it like async with keyed_lock(key). Not reentrant, so don't take the same key twice in the same task."""
+    def __init__(self):
+        self._locks: typing.Dict[typing.Any, typing.List] = {} # key -> [lock, amount of users]
+
+    def __call__(self, key):
+        return self._KeyedLockContext(self, key)
+
+    def __len__(self):
+        return len(self._locks)
+
+    class _KeyedLockContext():
+        __slots__ = ("keyed_lock", "key")
+
+        def __init__(self, keyed_lock, key):
+            self.keyed_lock = keyed_lock
+            self.key = key
+
+        async def __aenter__(self):
+            entry = self.keyed_lock._locks.setdefault(self.key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                await entry[0].acquire()
+            except:
+                self._release_user(entry)
+                raise
+
+        async def __aexit__(self, *args):
+            entry = self.keyed_lock._locks[self.key]
+            entry[0].release()
+            self._release_user(entry)
+
+        def _release_user(self, entry):
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.keyed_lock._locks[self.key]
+
+class CoalescingScheduler():
+    """Runs callbacks for keys after a short delay. If a key is scheduled again before its callback runs,
+    only the latest callback is kept. Callbacks for the same key never run at the same time."""
+    def __init__(self, delay: float, loop: asyncio.AbstractEventLoop, on_error = None):
+        self.delay = delay
+        self.loop = loop
+        self.on_error = on_error
+        self.pending: typing.Dict[typing.Any, typing.Callable[[], typing.Awaitable]] = {}
+        self.tasks: typing.Dict[typing.Any, asyncio.Task] = {}
+        self.coalesced = 0
+
+    def schedule(self, key, callback: typing.Callable[[], typing.Awaitable]):
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = callback
+
+        if not key in self.tasks:
+            self.tasks[key] = self.loop.create_task(self._run(key))
+
+    async def _run(self, key):
+        try:
+            # anything scheduled while the callback was running gets ran afterwards
+            while key in self.pending:
+                await asyncio.sleep(self.delay)
+                callback = self.pending.pop(key)
+
+                try:
+                    await callback()
+                except Exception as e:
+                    if self.on_error:
+                        await self.on_error(e)
+        finally:
+            self.tasks.pop(key, None)
+
+class MessageCache():
+    """A small cache of fetched messages, so that the same message isn't fetched over and over again.
+    Messages expire after ttl seconds, and the least recently used ones are dropped once there's more than max_size of them.
+    Anything that edits or deletes a message should discard it from here."""
+    __slots__ = ("ttl", "max_size", "_messages", "hits", "misses")
+
+    def __init__(self, ttl: float = 300, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._messages: typing.Dict[int, typing.Tuple[float, discord.Message]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message_id) -> typing.Optional[discord.Message]:
+        entry = self._messages.get(message_id)
+        if entry == None or entry[0] < time.monotonic():
+            if entry != None:
+                del self._messages[message_id]
+            self.misses += 1
+            return None
+
+        self._messages.move_to_end(message_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, message: discord.Message):
+        self._messages[message.id] = (time.monotonic() + self.ttl, message)
+        self._messages.move_to_end(message.id)
+
+        while len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+
+    def discard(self, message_id):
+        self._messages.pop(message_id, None)
+
+    def __contains__(self, message_id):
+        # unlike get, doesn't count as a hit or miss
+        entry = self._messages.get(message_id)
+        return entry != None and entry[0] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._messages)
+
+class DeathMessages():
+    """The death messages from Minecraft, used by the kill command.
+    They're cached on disk, one per line, so that starting up doesn't need to download them.
+    Nothing is read until the first time they're needed, and the cache is refreshed in the background when it's old."""
+    url = "https://raw.githubusercontent.com/InventivetalentDev/minecraft-assets/1.16.5/assets/minecraft/lang/en_us.json"
+    excluded = ("death.attack.message_too_long", "death.attack.badRespawnPoint.link")
+    max_age = 604800 # a week, in seconds
+    wait_timeout = 2 # how long a command will wait on a download before settling for the fallback
+    fallback = ["%1$s died"] # death.attack.generic, for when there's no cache and no way of downloading one
+
+    def __init__(self, path: str, loop: asyncio.AbstractEventLoop):
+        self.path = path
+        self.loop = loop
+        self.messages: typing.Optional[typing.List[str]] = None
+        self.refresh_task: typing.Optional[asyncio.Task] = None
+
+    def load(self) -> bool:
+        # loads the messages from the disk cache, returning if it was there
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                messages = [line for line in f.read().splitlines() if line]
+        except OSError:
+            return False
+
+        if messages:
+            self.messages = messages
+        return bool(messages)
+
+    def is_stale(self):
+        try:
+            return time.time() - os.path.getmtime(self.path) > self.max_age
+        except OSError:
+            return True
+
+    async def refresh(self):
+        """Downloads the death messages and writes them to the disk cache."""
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self.url) as resp:
+                mc_en_us_config = await resp.json(content_type='text/plain')
+
+        messages = [value for key, value in mc_en_us_config.items()
+            if key.startswith("death.") and key not in self.excluded]
+
+        # written to a temporary file first so a crash can't leave a half-written cache
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(m.replace("\n", " ") for m in messages))
+        os.replace(tmp_path, self.path)
+
+        self.messages = messages
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.warning(f"Could not refresh the death messages: {e!r}")
+
+    def start_refresh(self):
+        """Refreshes the messages in the background, if that isn't already happening."""
+        if not self.refresh_task or self.refresh_task.done():
+            self.refresh_task = self.loop.create_task(self._background_refresh())
+        return self.refresh_task
+
+    def prepare(self):
+        """Starts downloading the messages if there's no disk cache yet, so the first command doesn't have to wait.
+        An existing cache is still left unread until it's needed."""
+        if not os.path.exists(self.path):
+            self.start_refresh()
+
+    async def get(self) -> typing.List[str]:
+        """Gets the death messages, loading them if needed."""
+        if self.messages == None:
+            if not self.load():
+                # nothing cached, so we have to wait for the download this time - but not for long
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.start_refresh()), timeout=self.wait_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            elif self.is_stale():
+                self.start_refresh()
+
+        return self.messages or self.fallback
+
 class TimeDurationConverter(commands.Converter):
     """Converts a string to a time duration.
     Works very similarly to YAGPDB's time duration converter."""
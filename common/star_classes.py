@@ -1,6 +1,8 @@
 #!/usr/bin/env python3.7
 import discord, collections, enum
-import typing, random
+import typing, random, bisect
+import array, os, json
+import asyncio, glob
 
 class ReactorType(enum.Enum):
     """A way of sorting through the reactor list types."""
@@ -8,11 +10,56 @@ class ReactorType(enum.Enum):
     VAR_REACTORS = 2
     ALL_REACTORS = 3
 
+class CompactReactors():
+    """A set-like way of storing reactor IDs as a sorted array of 64-bit integers.
+    Uses a lot less memory than a set of ints, at the cost of slower adds and removes."""
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, reactors = ()):
+        self._ids = array.array("Q", sorted(set(reactors)))
+
+    def __repr__(self):
+        return f"CompactReactors({list(self._ids)})"
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, reactor_id):
+        index = bisect.bisect_left(self._ids, reactor_id)
+        return index < len(self._ids) and self._ids[index] == reactor_id
+
+    def __or__(self, other):
+        return set(self._ids).union(other)
+
+    __ror__ = __or__
+
+    def add(self, reactor_id):
+        index = bisect.bisect_left(self._ids, reactor_id)
+        if not (index < len(self._ids) and self._ids[index] == reactor_id):
+            self._ids.insert(index, reactor_id)
+
+    def discard(self, reactor_id):
+        index = bisect.bisect_left(self._ids, reactor_id)
+        if index < len(self._ids) and self._ids[index] == reactor_id:
+            del self._ids[index]
+
+def reactor_set(reactors = ()):
+    """Makes the container used to store reactors in an entry.
+    If COMPACT_REACTORS is true, this will be a CompactReactors instead of a set."""
+    if os.environ.get("COMPACT_REACTORS") == "true":
+        return CompactReactors(reactors)
+    return set(reactors)
+
 class StarboardEntry():
     """A way of representing a starboard entry in an easy way."""
 
     __slots__ = ("ori_mes_id", "ori_chan_id", "star_var_id", "starboard_id", "author_id",
-         "ori_reactors", "var_reactors", "guild_id", "forced", "updated", "frozen", "trashed")
+         "ori_reactors", "var_reactors", "guild_id", "forced", "updated", "frozen", "trashed", "unique_stars",
+         "reactor_deltas", "journal_deltas")
 
     def __repr__(self):
         return (f"<StarboardEntry ori_mes_id={self.ori_mes_id} ori_chan_id={self.ori_chan_id} star_var_id={self.star_var_id} " +
@@ -29,20 +76,37 @@ class StarboardEntry():
         self.star_var_id = star_var_id
         self.starboard_id = starboard_id
         self.author_id = author_id
-        self.ori_reactors = set(ori_reactors)
-        self.var_reactors = set(var_reactors)
+        self.ori_reactors = reactor_set(ori_reactors)
+        self.var_reactors = reactor_set(var_reactors)
         self.guild_id = guild_id
         self.forced = forced
         self.frozen = frozen
         self.trashed = trashed
         self.updated = updated
 
+        # how many unique reactors there are between ori_reactors and var_reactors
+        # kept track of so that the union of the two doesn't need to be made just to count it
+        self.unique_stars = len(self.ori_reactors | self.var_reactors)
+
+        # (reactor_id, reactor type value) -> True if added, False if removed since the last flush
+        # None until a reactor changes, as most entries never change after being loaded
+        self.reactor_deltas: typing.Optional[typing.Dict[typing.Tuple[int, int], bool]] = None
+        # the same, but since the entry was last written to the journal
+        self.journal_deltas: typing.Optional[typing.Dict[typing.Tuple[int, int], bool]] = None
+
     @classmethod
-    def from_row(cls, row):
-        """Returns an entry from a row."""
+    def from_row(cls, row, reactors: typing.Optional[typing.Tuple[list, list]] = None):
+        """Returns an entry from a row. If reactors is specified (as ori reactors and var reactors),
+        it will be used instead of the reactors in the row's data."""
         data = row["data"]
+        if reactors == None:
+            if not "ori_reactors" in data or not "var_reactors" in data:
+                # defaulting to no reactors here would silently wipe them the next time the entry is saved
+                raise KeyError(f"Entry {row['ori_mes_id']} has no reactors in its data. Are they in the reactor table?")
+            reactors = (data["ori_reactors"], data["var_reactors"])
+
         return cls(row["ori_mes_id"], data["ori_chan_id"], data["star_var_id"], data["starboard_id"],
-            data["author_id"], data["ori_reactors"], data["var_reactors"], data["guild_id"], data["forced"],
+            data["author_id"], reactors[0], reactors[1], data["guild_id"], data["forced"],
             data["frozen"], data["trashed"])
 
     @classmethod
@@ -55,23 +119,72 @@ class StarboardEntry():
             return cls(mes.id, mes.channel.id, None, None, author_id, set(), set(), mes.guild.id, forced, 
             False, False, updated=True)
 
-    def to_dict(self) -> dict:
-        """Converts this class to a dict."""
+    def to_dict(self, include_reactors = True) -> dict:
+        """Converts this class to a dict. Reactors can be left out if they're stored elsewhere."""
         result = {
             key: getattr(self, key)
             for key in self.__slots__
-            if hasattr(self, key)
+            if hasattr(self, key) and key not in ("unique_stars", "reactor_deltas", "journal_deltas", "ori_reactors", "var_reactors")
         }
 
+        if include_reactors:
+            # sets can't be converted to json
+            result["ori_reactors"] = list(self.ori_reactors)
+            result["var_reactors"] = list(self.var_reactors)
+
         return result
 
-    def get_reactors(self) -> typing.Set[int]:
-        """Gets the total reactors, a mix of ori and var reactors."""
-        if not isinstance(self.ori_reactors, set):
-            self.ori_reactors = set(self.ori_reactors)
-        if not isinstance(self.var_reactors, set):
-            self.var_reactors = set(self.var_reactors)
+    def _record_delta(self, reactor_id, type_of_reactor: ReactorType, added: bool):
+        if self.reactor_deltas == None:
+            self.reactor_deltas = {}
+        self.reactor_deltas[(reactor_id, type_of_reactor.value)] = added
+
+        if self.journal_deltas == None:
+            self.journal_deltas = {}
+        self.journal_deltas[(reactor_id, type_of_reactor.value)] = added
+
+    def pop_reactor_deltas(self) -> typing.Tuple[typing.List[typing.Tuple[int, int]], typing.List[typing.Tuple[int, int]]]:
+        """Gets the reactors added and removed since this was last called, as lists of (reactor_id, reactor type value)."""
+        added = []
+        removed = []
+
+        if self.reactor_deltas:
+            for key, was_added in self.reactor_deltas.items():
+                if was_added:
+                    added.append(key)
+                else:
+                    removed.append(key)
+
+        self.reactor_deltas = None
+        return added, removed
+
+    def pop_journal_deltas(self) -> typing.List[typing.Tuple[int, int, bool]]:
+        """Gets the reactor changes since this was last called, as a list of (reactor_id, reactor type value, added)."""
+        deltas = [(reactor_id, reactor_type, added) for (reactor_id, reactor_type), added in (self.journal_deltas or {}).items()]
+        self.journal_deltas = None
+        return deltas
+
+    def restore_reactor_deltas(self, added, removed):
+        """Puts back reactor deltas from pop_reactor_deltas, like if a flush failed.
+        Any changes made since then take priority."""
+        for key in added:
+            self._restore_delta(key, True)
+        for key in removed:
+            self._restore_delta(key, False)
+
+    def _restore_delta(self, key, added: bool):
+        if self.reactor_deltas == None:
+            self.reactor_deltas = {}
+        self.reactor_deltas.setdefault(key, added)
+
+    def get_all_reactors(self) -> typing.List[typing.Tuple[int, int]]:
+        """Gets every reactor as a list of (reactor_id, reactor type value)."""
+        return ([(r, ReactorType.ORI_REACTORS.value) for r in self.ori_reactors] +
+            [(r, ReactorType.VAR_REACTORS.value) for r in self.var_reactors])
 
+    def get_reactors(self) -> typing.Set[int]:
+        """Gets the total reactors, a mix of ori and var reactors.
+        This makes a new set - use unique_stars or check_reactor if you only need the count or a membership check."""
         return self.ori_reactors | self.var_reactors
 
     def get_reactors_from_type(self, type_of_reactor: ReactorType) -> typing.List[int]:
@@ -87,12 +200,40 @@ class StarboardEntry():
 
     def set_reactors_of_type(self, type_of_reactor: ReactorType, input: set):
         """Sets the reactors for the type specified. Useful if you want the output to vary."""
+        if not type_of_reactor in (ReactorType.ORI_REACTORS, ReactorType.VAR_REACTORS):
+            raise AttributeError("Invalid reactor type.")
+
+        new_reactors = reactor_set(input)
+        old_reactors = self.get_reactors_from_type(type_of_reactor)
+
+        for reactor_id in old_reactors:
+            if not reactor_id in new_reactors:
+                self._record_delta(reactor_id, type_of_reactor, False)
+        for reactor_id in new_reactors:
+            if not reactor_id in old_reactors:
+                self._record_delta(reactor_id, type_of_reactor, True)
+
         if type_of_reactor == ReactorType.ORI_REACTORS:
-            self.ori_reactors = input
-        elif type_of_reactor == ReactorType.VAR_REACTORS:
-            self.var_reactors =  input
+            self.ori_reactors = new_reactors
         else:
-            raise AttributeError("Invalid reactor type.")
+            self.var_reactors = new_reactors
+
+        self.unique_stars = len(self.ori_reactors | self.var_reactors)
+
+    def apply_reactor_delta(self, reactor_id, type_of_reactor: ReactorType, added: bool):
+        """Adds or removes a reactor from only the reactor type specified, like when replaying a journal.
+        Does nothing if the reactor is already added or removed."""
+        reactors = self.get_reactors_from_type(type_of_reactor)
+        if added == (reactor_id in reactors):
+            return
+
+        if added:
+            reactors.add(reactor_id)
+        else:
+            reactors.discard(reactor_id)
+
+        self._record_delta(reactor_id, type_of_reactor, added)
+        self.unique_stars = len(self.ori_reactors | self.var_reactors)
 
     def check_reactor(self, reactor_id, type_of_reactor = ReactorType.ALL_REACTORS) -> bool:
         """Sees if the reactor ID provided is in the reactors for the type specified. Useful if you want the output to vary."""
@@ -101,13 +242,13 @@ class StarboardEntry():
         elif type_of_reactor == ReactorType.VAR_REACTORS:
             return reactor_id in self.var_reactors
         elif type_of_reactor == ReactorType.ALL_REACTORS:
-            return reactor_id in self.get_reactors()
+            return reactor_id in self.ori_reactors or reactor_id in self.var_reactors
         else:
             raise AttributeError("Invalid reactor type.")
 
     def add_reactor(self, reactor_id, type_of_reactor: ReactorType):
         """Adds a reactor to the reactor type specified. Will silently fail if the entry already exists."""
-        if not reactor_id in self.get_reactors():
+        if not self.check_reactor(reactor_id):
             if type_of_reactor == ReactorType.ORI_REACTORS:
                 self.ori_reactors.add(reactor_id)
             elif type_of_reactor == ReactorType.VAR_REACTORS:
@@ -115,42 +256,358 @@ class StarboardEntry():
             else:
                 raise AttributeError("Invalid reactor type.")
 
+            self.unique_stars += 1
+            self._record_delta(reactor_id, type_of_reactor, True)
+
     def remove_reactor(self, reactor_id):
         """Removes a reactor from an entry. Will silently fail if the entry does not exists."""
-        if reactor_id in self.get_reactors():
-            self.ori_reactors.discard(reactor_id)
-            self.var_reactors.discard(reactor_id)
+        if self.check_reactor(reactor_id):
+            for type_of_reactor in (ReactorType.ORI_REACTORS, ReactorType.VAR_REACTORS):
+                if reactor_id in self.get_reactors_from_type(type_of_reactor):
+                    self.get_reactors_from_type(type_of_reactor).discard(reactor_id)
+                    self._record_delta(reactor_id, type_of_reactor, False)
+
+            self.unique_stars -= 1
+
+
+class StarRanking():
+    """A ranking of IDs by how many stars they have. Kept sorted at all times,
+    so getting the top IDs or the rank of one ID doesn't require sorting everything."""
+
+    __slots__ = ("scores", "_order")
+
+    def __init__(self):
+        self.scores = {}
+        self._order = [] # sorted list of (-score, id), so the highest score comes first
+
+    def __len__(self):
+        return len(self._order)
+
+    def set(self, key, score):
+        """Sets the score of an ID, adding it to the ranking if needed."""
+        old_score = self.scores.get(key)
+        if old_score == score:
+            return
+
+        if old_score != None:
+            del self._order[bisect.bisect_left(self._order, (-old_score, key))]
+
+        self.scores[key] = score
+        bisect.insort(self._order, (-score, key))
+
+    def add(self, key, amount):
+        """Adds (or subtracts, if negative) to the score of an ID. IDs that go down to 0 are removed."""
+        new_score = self.scores.get(key, 0) + amount
+        if new_score > 0:
+            self.set(key, new_score)
+        else:
+            self.remove(key)
+
+    def remove(self, key):
+        """Removes an ID from the ranking. Will silently fail if the ID isn't in it."""
+        old_score = self.scores.pop(key, None)
+        if old_score != None:
+            del self._order[bisect.bisect_left(self._order, (-old_score, key))]
+
+    def top(self, amount = None, offset = 0) -> typing.List[typing.Tuple[int, int]]:
+        """Gets a list of (ID, score) tuples, starting from the highest score."""
+        end = None if amount == None else offset + amount
+        return [(key, -score) for score, key in self._order[offset:end]]
+
+    def rank(self, key) -> typing.Optional[int]:
+        """Gets the position (starting at 1) of an ID in the ranking, or None if it isn't in it."""
+        score = self.scores.get(key)
+        if score == None:
+            return None
+        return bisect.bisect_left(self._order, (-score, key)) + 1
+
+class IndexedSet():
+    """A set that can also be indexed, allowing a random item to be picked without making a list.
+    Removing swaps the last item into the removed item's place, so adding and removing are both O(1)."""
+
+    __slots__ = ("_items", "_positions")
+
+    def __init__(self):
+        self._items = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def add(self, item):
+        if not item in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        position = self._positions.pop(item, None)
+        if position != None:
+            last_item = self._items.pop()
+            if position < len(self._items):
+                self._items[position] = last_item
+                self._positions[last_item] = position
+
+    def random(self):
+        """Gets a random item. Raises IndexError if there are no items."""
+        return random.choice(self._items)
+
+class StarboardJournal():
+    """An append-only journal of starboard changes that haven't been written to the database yet.
+    It's split into numbered segments, so that segments that have been flushed can be deleted
+    while new changes keep being written to a new segment."""
+
+    __slots__ = ("path", "segment", "_file", "_dirty", "_lock")
+
+    def __init__(self, path):
+        self.path = path
+        self.segment = max(self.get_segments(), default=0) + 1
+        self._file = open(self.segment_path(self.segment), "a", encoding="utf-8")
+        self._dirty = False
+        self._lock = asyncio.Lock()
+
+    def segment_path(self, segment):
+        return f"{self.path}.{segment}"
+
+    def get_segments(self) -> typing.List[int]:
+        """Gets the numbers of every segment on disk, in order."""
+        segments = []
+        for segment_path in glob.glob(f"{glob.escape(self.path)}.*"):
+            suffix = segment_path.rsplit(".", 1)[-1]
+            if suffix.isdigit():
+                segments.append(int(suffix))
 
+        return sorted(segments)
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._dirty = True
+
+    def write_add(self, entry: "StarboardEntry"):
+        self._write({"op": "add", "entry": entry.to_dict()})
+
+    def write_update(self, entry: "StarboardEntry", reactor_deltas: typing.List[typing.Tuple[int, int, bool]]):
+        # only the reactors that changed are written, as writing every reactor of a popular entry
+        # on every star would make the journal huge
+        self._write({"op": "update", "entry": entry.to_dict(include_reactors=False), "reactors": reactor_deltas})
+
+    def write_delete(self, entry_id, guild_id):
+        self._write({"op": "delete", "id": entry_id, "guild_id": guild_id})
+
+    def read(self) -> typing.Iterator[dict]:
+        """Reads the records of every segment before the current one, in order."""
+        for segment in self.get_segments():
+            if segment >= self.segment:
+                break
+
+            with open(self.segment_path(segment), encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # most likely a partially written line from a crash, which can only be the last one
+                        break
+
+    async def sync(self):
+        """Makes sure everything written so far is on disk. Meant to be ran every few hundred milliseconds."""
+        async with self._lock:
+            if self._dirty:
+                self._dirty = False
+                self._file.flush()
+                await asyncio.get_event_loop().run_in_executor(None, os.fsync, self._file.fileno())
+
+    async def rotate(self) -> int:
+        """Starts a new segment. Returns the number of the new segment,
+        which can be passed to truncate once everything before it has been flushed."""
+        await self.sync()
+
+        async with self._lock:
+            self._file.close()
+            self.segment += 1
+            self._file = open(self.segment_path(self.segment), "a", encoding="utf-8")
+
+        return self.segment
+
+    def truncate(self, before: int):
+        """Deletes every segment before the segment number given."""
+        for segment in self.get_segments():
+            if segment >= before:
+                break
+            os.remove(self.segment_path(segment))
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
 
 class StarboardEntries():
     """A way of managing starboard entries."""
 
-    __slots__ = ("entries", "added", "updated", "removed")
+    __slots__ = ("entries", "added", "updated", "removed", "var_index", "_indexed_vars",
+        "author_rankings", "message_rankings", "_star_counts", "posted_entries", "journal",
+        "loader", "fetcher", "max_entries", "loaded_guilds", "_guild_locks")
 
     def __init__(self):
-        self.entries = collections.defaultdict(lambda: None)
+        self.entries = {}
         self.added = set()
         self.updated = set()
         self.removed = set()
 
+        # if set, every change is also written to this, so it isn't lost if the bot crashes before a flush
+        self.journal: typing.Optional[StarboardJournal] = None
+
+        # star_var_id -> ori_mes_id, so that looking up an entry from its starboard variant
+        # doesn't have to go through every entry
+        self.var_index = {}
+        # ori_mes_id -> the star_var_id currently in var_index, so stale IDs can be removed
+        self._indexed_vars = {}
+        # guild_id -> IndexedSet of the ori_mes_ids of entries on the starboard, used for picking random entries
+        self.posted_entries = {}
+
+        # guild_id -> StarRanking of author_id by total stars, kept up to date as entries change
+        self.author_rankings = {}
+        # guild_id -> StarRanking of ori_mes_id by stars, for getting the top messages quickly
+        self.message_rankings = {}
+        # ori_mes_id -> the star count last counted in author_rankings
+        # this has every entry known about, including ones that have been evicted
+        self._star_counts = {}
+
+        # if a loader is set, a guild's entries are only indexed once the guild is used (see ensure_guild)
+        # it should be an async generator function that takes a guild ID and yields
+        # (ori_mes_id, author_id, star_var_id, unique stars) for each of that guild's entries
+        self.loader = None
+        # a coroutine function that takes an ori_mes_id and gets that entry from the database, used for evicted entries
+        self.fetcher = None
+        # if set, the least recently used entries past this amount are evicted from memory when evict is called
+        # evicted entries stay in every index, so they can be loaded again with fetch
+        self.max_entries: typing.Optional[int] = None
+        self.loaded_guilds = set()
+        self._guild_locks = {}
+
     def reset_deltas(self):
         """Resets the deltas so that they have nothing."""
         self.added = set()
         self.updated = set()
         self.removed = set()
 
+    def restore_deltas(self, added, updated, removed):
+        """Puts back deltas from a flush that failed, merging them with any changes made since."""
+        for entry_id in added:
+            if not entry_id in self.removed: # if it was deleted since, it was never in the database anyways
+                self.added.add(entry_id)
+                self.updated.discard(entry_id)
+
+        for entry_id in updated:
+            if not entry_id in self.added and not entry_id in self.removed:
+                self.updated.add(entry_id)
+
+        for entry_id in removed:
+            if entry_id in self.added:
+                # made again since, but the old row is still there
+                self.added.discard(entry_id)
+                self.updated.add(entry_id)
+            else:
+                self.removed.add(entry_id)
+
+    def index_var(self, entry: StarboardEntry):
+        """Syncs the starboard variant index with the star_var_id of the entry.
+        Should be called whenever star_var_id is changed - update does this automatically."""
+        old_var_id = self._indexed_vars.get(entry.ori_mes_id)
+        if old_var_id == entry.star_var_id:
+            return
+
+        if old_var_id != None:
+            self.var_index.pop(old_var_id, None)
+            del self._indexed_vars[entry.ori_mes_id]
+
+        if entry.star_var_id != None:
+            self.var_index[entry.star_var_id] = entry.ori_mes_id
+            self._indexed_vars[entry.ori_mes_id] = entry.star_var_id
+            self.posted_entries.setdefault(entry.guild_id, IndexedSet()).add(entry.ori_mes_id)
+        else:
+            self._unindex_posted(entry.guild_id, entry.ori_mes_id)
+
+    def unindex_var(self, entry: StarboardEntry):
+        """Removes an entry from the starboard variant index."""
+        old_var_id = self._indexed_vars.pop(entry.ori_mes_id, None)
+        if old_var_id != None:
+            self.var_index.pop(old_var_id, None)
+            self._unindex_posted(entry.guild_id, entry.ori_mes_id)
+
+    def _unindex_posted(self, guild_id, entry_id):
+        posted = self.posted_entries.get(guild_id)
+        if posted != None:
+            posted.discard(entry_id)
+            if not posted:
+                del self.posted_entries[guild_id]
+
+    def index_stars(self, entry: StarboardEntry):
+        """Syncs the author and message rankings with the amount of stars the entry has.
+        Should be called whenever the reactors of an entry change - update does this automatically."""
+        old_stars = self._star_counts.get(entry.ori_mes_id, 0)
+        new_stars = entry.unique_stars
+        self._star_counts[entry.ori_mes_id] = new_stars
+        self.message_rankings.setdefault(entry.guild_id, StarRanking()).set(entry.ori_mes_id, new_stars)
+
+        if old_stars != new_stars:
+            rankings = self.author_rankings.setdefault(entry.guild_id, StarRanking())
+            rankings.add(entry.author_id, new_stars - old_stars)
+
+            if not rankings:
+                del self.author_rankings[entry.guild_id]
+
+    def unindex_stars(self, entry: StarboardEntry):
+        """Removes the stars of an entry from the author and message rankings."""
+        old_stars = self._star_counts.pop(entry.ori_mes_id, 0)
+
+        message_rankings = self.message_rankings.get(entry.guild_id)
+        if message_rankings != None:
+            message_rankings.remove(entry.ori_mes_id)
+            if not message_rankings:
+                del self.message_rankings[entry.guild_id]
+
+        rankings = self.author_rankings.get(entry.guild_id)
+
+        if old_stars and rankings != None:
+            rankings.add(entry.author_id, -old_stars)
+            if not rankings:
+                del self.author_rankings[entry.guild_id]
+
+    def add_known(self, ori_mes_id, guild_id, author_id, star_var_id, stars):
+        """Indexes an entry without keeping the entry itself in memory, as if it had been evicted.
+        Used when loading a guild, so that the rankings and random picks work without every entry being loaded."""
+        self._star_counts[ori_mes_id] = stars
+        self.message_rankings.setdefault(guild_id, StarRanking()).set(ori_mes_id, stars)
+        if stars:
+            self.author_rankings.setdefault(guild_id, StarRanking()).add(author_id, stars)
+
+        if star_var_id != None:
+            self.var_index[star_var_id] = ori_mes_id
+            self._indexed_vars[ori_mes_id] = star_var_id
+            self.posted_entries.setdefault(guild_id, IndexedSet()).add(ori_mes_id)
+
     def add(self, entry: StarboardEntry, init = False):
         """Adds an entry to the list of entries. Or, well, the dict of entries."""
-        if self.entries[entry.ori_mes_id] == None:
+        if self.entries.get(entry.ori_mes_id) == None:
             self.entries[entry.ori_mes_id] = entry
+            self.index_var(entry)
+            self.index_stars(entry)
+            entry.journal_deltas = None # the entry is written in full, if it's written at all
+
             if not init:
                 self.added.add(entry.ori_mes_id)
+                if self.journal:
+                    self.journal.write_add(entry)
         else:
             raise Exception(f"Entry {entry.ori_mes_id} already exists.")
 
     def delete(self, entry_id):
         """Removes an entry from the dict of entries."""
-        del self.entries[entry_id]
+        entry = self.entries.pop(entry_id)
+        self.unindex_var(entry)
+        self.unindex_stars(entry)
 
         if entry_id in self.added:
             self.added.discard(entry_id)
@@ -159,29 +616,172 @@ class StarboardEntries():
                 self.updated.discard(entry_id)
             self.removed.add(entry_id)
 
+        if self.journal:
+            self.journal.write_delete(entry_id, entry.guild_id)
+
     def update(self, entry: StarboardEntry):
-        """Updates an entry in the dict of entries."""
-        if self.entries[entry.ori_mes_id] != None:
+        """Updates an entry in the dict of entries. Evicted entries are put back into the dict of entries."""
+        if self.entries.get(entry.ori_mes_id) != None or entry.ori_mes_id in self._star_counts:
             self.entries[entry.ori_mes_id] = entry
+            self.index_var(entry)
+            self.index_stars(entry)
 
             if not entry.ori_mes_id in self.added:
                 self.updated.add(entry.ori_mes_id)
+
+            reactor_deltas = entry.pop_journal_deltas()
+            if self.journal:
+                self.journal.write_update(entry, reactor_deltas)
         else:
             raise KeyError(f"Entry {entry.ori_chan_id} does not exist in the current entries.")
 
+    async def replay(self, records: typing.Iterable[dict]):
+        """Applies records from a StarboardJournal, marking them as changes that need to be flushed."""
+        for record in records:
+            if record["op"] == "add":
+                data = record["entry"]
+                entry = StarboardEntry.from_row({"ori_mes_id": data["ori_mes_id"], "data": data})
+
+                existing = await self.fetch(entry.ori_mes_id, entry.guild_id)
+                if existing != None:
+                    # applying the changes to the existing entry, rather than replacing it,
+                    # records the reactor changes as deltas
+                    self._apply_fields(existing, data)
+                    existing.set_reactors_of_type(ReactorType.ORI_REACTORS, entry.ori_reactors)
+                    existing.set_reactors_of_type(ReactorType.VAR_REACTORS, entry.var_reactors)
+                    self.update(existing)
+                else:
+                    self.add(entry)
+            elif record["op"] == "update":
+                data = record["entry"]
+                existing = await self.fetch(data["ori_mes_id"], data["guild_id"])
+                if existing == None: # deleted in a way the journal didn't see, so there's nothing to update
+                    continue
+
+                self._apply_fields(existing, data)
+                for reactor_id, reactor_type, added in record["reactors"]:
+                    existing.apply_reactor_delta(reactor_id, ReactorType(reactor_type), added)
+                self.update(existing)
+            elif record["op"] == "delete":
+                existing = await self.fetch(record["id"], record.get("guild_id"))
+                if existing != None and existing.ori_mes_id == record["id"]:
+                    self.delete(record["id"])
+
+    @staticmethod
+    def _apply_fields(entry: StarboardEntry, data: dict):
+        for key in ("star_var_id", "starboard_id", "forced", "frozen", "trashed"):
+            setattr(entry, key, data[key])
+
     def get(self, entry_id, check_for_var = False) -> typing.Optional[StarboardEntry]:
-        """Gets an entry based on the ID provides."""
-        if self.entries[entry_id] != None:
-            if not check_for_var or self.entries[entry_id].star_var_id != None:
-                return self.entries[entry_id]
-            else:
+        """Gets an entry based on the ID provides. Never adds keys to the dict of entries.
+        Only looks at what's in memory - use fetch if the guild might not be loaded or the entry might be evicted."""
+        entry = self.entries.get(entry_id)
+        if entry != None:
+            if check_for_var and entry.star_var_id == None:
                 return None
         else:
-            entry = discord.utils.find(lambda e: e != None and e.star_var_id == entry_id, self.entries.values())
+            ori_mes_id = self.var_index.get(entry_id)
+            if ori_mes_id == None:
+                return None
+            entry = self.entries.get(ori_mes_id)
+            if entry == None:
+                return None
+
+        if self.max_entries != None:
+            # moves the entry to the end, making it the most recently used
+            self.entries[entry.ori_mes_id] = self.entries.pop(entry.ori_mes_id)
+
+        return entry
+
+    async def fetch(self, entry_id, guild_id = None, check_for_var = False) -> typing.Optional[StarboardEntry]:
+        """Gets an entry based on the ID provided, like get.
+        Makes sure the guild specified is loaded first, and loads the entry from the database if it was evicted."""
+        if guild_id != None:
+            await self.ensure_guild(guild_id)
+
+        entry = self.get(entry_id, check_for_var)
+        if entry != None or self.fetcher == None:
             return entry
 
+        ori_mes_id = self.var_index.get(entry_id, entry_id)
+        if not ori_mes_id in self._star_counts: # we don't know about this entry at all
+            return None
+
+        entry = await self.fetcher(ori_mes_id)
+        if entry != None and self.entries.get(ori_mes_id) == None and ori_mes_id in self._star_counts:
+            self.add(entry, init=True)
+
+        return self.get(entry_id, check_for_var)
+
+    async def ensure_guild(self, guild_id):
+        """Makes sure every entry of the guild has been indexed at some point.
+        The entries themselves aren't loaded - fetch gets them from the fetcher when they're needed.
+        Does nothing if there is no loader."""
+        if self.loader == None or guild_id in self.loaded_guilds:
+            return
+
+        lock = self._guild_locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            if guild_id in self.loaded_guilds:
+                return
+
+            async for ori_mes_id, author_id, star_var_id, stars in self.loader(guild_id):
+                # entries might have been made or deleted while the guild was loading
+                if ori_mes_id in self._star_counts or ori_mes_id in self.removed:
+                    continue
+                self.add_known(ori_mes_id, guild_id, author_id, star_var_id, stars)
+
+            self.loaded_guilds.add(guild_id)
+
+        self._guild_locks.pop(guild_id, None)
+
+    def evict(self) -> int:
+        """Evicts the least recently used entries until there are at most max_entries of them.
+        Entries with changes that haven't been flushed are never evicted. Returns how many were evicted."""
+        if self.max_entries == None or len(self.entries) <= self.max_entries:
+            return 0
+
+        to_evict = len(self.entries) - self.max_entries
+        evicted = []
+
+        for entry_id, entry in self.entries.items():
+            if len(evicted) >= to_evict:
+                break
+            if entry_id in self.added or entry_id in self.updated or entry.reactor_deltas:
+                continue
+            evicted.append(entry)
+
+        for entry in evicted:
+            del self.entries[entry.ori_mes_id]
+
+        return len(evicted)
+
+    async def fetch_random_posted(self, guild_id) -> typing.Optional[StarboardEntry]:
+        """Gets a random entry that is on the starboard for the guild specified, or None if there are none."""
+        posted = self.posted_entries.get(guild_id)
+        if not posted:
+            return None
+        return await self.fetch(posted.random(), guild_id)
+
+    def count_posted(self, guild_id) -> int:
+        """Gets how many entries are on the starboard for the guild specified."""
+        return len(self.posted_entries.get(guild_id, ()))
+
+    def get_author_rankings(self, guild_id) -> typing.Optional[StarRanking]:
+        """Gets the author rankings for a guild, or None if no one in the guild has any stars."""
+        return self.author_rankings.get(guild_id)
+
+    def get_message_rankings(self, guild_id) -> typing.Optional[StarRanking]:
+        """Gets the message rankings (by ori_mes_id) for a guild, or None if the guild has no entries."""
+        return self.message_rankings.get(guild_id)
+
+    def count(self) -> typing.Tuple[int, int]:
+        """Returns how many entries are in memory, and how many entries are known about (including evicted ones)."""
+        return len(self.entries), len(self._star_counts)
+
     def get_list(self, list_filter) -> typing.List[StarboardEntry]:
-        """Gets specific entries based on the filter (a lambda or function) specified."""
+        """Gets specific entries based on the filter (a lambda or function) specified.
+        Only entries in memory are looked through."""
         return [e for e in self.entries.values() if e != None and list_filter(e)]
 
     def get_random(self, list_filter) -> StarboardEntry:
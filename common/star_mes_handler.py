@@ -51,7 +51,7 @@ async def base_generate(bot, mes: discord.Message, no_attachments = False):
     and mes.embeds[0].author.name != bot.user.name and mes.embeds[0].color.value == 0x4378fc)): # if message is sniped message that's supported
         snipe_embed = mes.embeds[0]
 
-        entry = bot.starboard.get(mes.id)
+        entry = await bot.starboard.fetch(mes.id, mes.guild.id)
 
         if entry:
             author = await utils.user_from_id(bot, mes.guild, entry.author_id)
@@ -188,7 +188,7 @@ async def send(bot, mes: discord.Message):
     # sends message to starboard channel
 
     send_embed = await star_generate(bot, mes)
-    star_entry = bot.starboard.get(mes.id)
+    star_entry = await bot.starboard.fetch(mes.id, mes.guild.id)
     starboard_chan = mes.guild.get_channel(bot.config[mes.guild.id]["starboard_id"])
 
     if starboard_chan:
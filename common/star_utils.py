@@ -1,6 +1,7 @@
 #!/usr/bin/env python3.7
 import discord, collections
 import common.star_classes as star_classes
+import common.utils as utils
 
 def get_reactor_type(mes_id, starboard_entry: star_classes.StarboardEntry):
     return star_classes.ReactorType.ORI_REACTORS if mes_id == starboard_entry.ori_mes_id else star_classes.ReactorType.VAR_REACTORS
@@ -86,7 +87,7 @@ def get_author_id(mes, bot):
     return author_id
 
 def generate_content_str(entry: star_classes.StarboardEntry):
-    unique_stars = len(entry.get_reactors())
+    unique_stars = entry.unique_stars
     star_emoji = get_star_emoji(unique_stars)
     ori_chan_mention = f"<#{entry.ori_chan_id}>"
 
@@ -105,7 +106,7 @@ async def modify_stars(bot, mes: discord.Message, reactor_id, operation):
     # TODO: this method probably needs to be split up
     # modifies stars and creates an starboard entry if it doesn't exist already
 
-    starboard_entry = bot.starboard.get(mes.id)
+    starboard_entry = await bot.starboard.fetch(mes.id, mes.guild.id)
     if not starboard_entry:
         author_id = get_author_id(mes, bot)
         starboard_entry = star_classes.StarboardEntry.new_entry(mes, author_id, reactor_id)
@@ -120,14 +121,14 @@ async def modify_stars(bot, mes: discord.Message, reactor_id, operation):
         type_of = get_reactor_type(mes.id, starboard_entry)
         await sync_prev_reactors(bot, author_id, starboard_entry)
 
-        starboard_entry = bot.starboard.get(starboard_entry.ori_mes_id)
+        starboard_entry = await bot.starboard.fetch(starboard_entry.ori_mes_id, starboard_entry.guild_id)
         starboard_entry.updated = True
 
     if author_id != reactor_id:
         # this code probably needs slight rewriting
         type_of = get_reactor_type(mes.id, starboard_entry)
 
-        if not reactor_id in starboard_entry.get_reactors() and operation == "ADD":
+        if not starboard_entry.check_reactor(reactor_id) and operation == "ADD":
             starboard_entry.add_reactor(reactor_id, type_of)
 
         elif operation == "SUBTRACT" and reactor_id in starboard_entry.get_reactors_from_type(type_of):
@@ -173,7 +174,8 @@ async def sync_prev_reactors(bot, author_id, starboard_entry: star_classes.Starb
     ori_mes_chan = bot.get_channel(starboard_entry.ori_chan_id)
     if ori_mes_chan:
         try:
-            ori_mes = await ori_mes_chan.fetch_message(starboard_entry.ori_mes_id)
+            # the reactions of cached messages can be out of date, so these are always fetched
+            ori_mes = await utils.fetch_message(bot, ori_mes_chan, starboard_entry.ori_mes_id, fresh=True)
             await sync_reactors(bot, ori_mes, starboard_entry, star_classes.ReactorType.ORI_REACTORS, remove)
         except:
             pass
@@ -181,7 +183,7 @@ async def sync_prev_reactors(bot, author_id, starboard_entry: star_classes.Starb
     starboard_chan = bot.get_channel(starboard_entry.starboard_id)
     if starboard_chan:
         try:
-            star_mes = await starboard_chan.fetch_message(starboard_entry.star_var_id)
+            star_mes = await utils.fetch_message(bot, starboard_chan, starboard_entry.star_var_id, fresh=True)
             await sync_reactors(bot, star_mes, starboard_entry, star_classes.ReactorType.VAR_REACTORS, remove)
         except:
             pass
@@ -191,10 +193,10 @@ async def sync_prev_reactors(bot, author_id, starboard_entry: star_classes.Starb
 async def star_entry_refresh(bot, starboard_entry: star_classes.StarboardEntry, guild_id):
     # refreshes a starboard entry mes
     star_var_chan = bot.get_channel(starboard_entry.starboard_id) #TODO: ignore cases where bot can't access/use channel
-    unique_stars = len(starboard_entry.get_reactors())
+    unique_stars = starboard_entry.unique_stars
 
     try:
-        star_var_mes = await star_var_chan.fetch_message(starboard_entry.star_var_id)
+        star_var_mes = await utils.fetch_message(bot, star_var_chan, starboard_entry.star_var_id)
     except discord.HTTPException as e:
         # if exception: most likely this is because starboard channel has moved, so this is a fix
         if isinstance(e, (discord.NotFound, discord.Forbidden)):
@@ -203,7 +205,7 @@ async def star_entry_refresh(bot, starboard_entry: star_classes.StarboardEntry,
                 return
 
             try:
-                ori_mes = await ori_chan.fetch_message(starboard_entry.ori_mes_id)
+                ori_mes = await utils.fetch_message(bot, ori_chan, starboard_entry.ori_mes_id)
             except discord.HTTPException:
                 return
 
@@ -223,8 +225,30 @@ async def star_entry_refresh(bot, starboard_entry: star_classes.StarboardEntry,
         bot.starboard.update(starboard_entry)
 
         await star_var_mes.delete()
+        bot.message_cache.discard(star_var_mes.id)
         bot.star_queue.remove_from_copy((starboard_entry.ori_chan_id, starboard_entry.ori_mes_id, starboard_entry.guild_id))
 
+def entry_lock(bot, mes_id):
+    # gets the lock for the entry a message belongs to, or the message itself if it isn't an entry (yet)
+    # the guild's entries should have been loaded already, otherwise star variants can't be matched up
+    ori_mes_id = bot.starboard.var_index.get(mes_id, mes_id)
+    return bot.star_locks(ori_mes_id)
+
+def schedule_refresh(bot, starboard_entry: star_classes.StarboardEntry, guild_id):
+    # refreshes a starboard entry mes in a bit, using whatever the entry is like by then
+    # stars tend to come in bursts, so this stops us from editing the message for every single one
+    ori_mes_id = starboard_entry.ori_mes_id
+
+    async def refresh():
+        async with bot.star_locks(ori_mes_id):
+            latest_entry = await bot.starboard.fetch(ori_mes_id, guild_id)
+
+            # the entry could have been taken off the starboard or trashed while we were waiting
+            if latest_entry and latest_entry.star_var_id and not latest_entry.trashed:
+                await star_entry_refresh(bot, latest_entry, guild_id)
+
+    bot.star_refresher.schedule(ori_mes_id, refresh)
+
 def star_check(bot, payload):
     # basic check for starboard stuff: is it in a guild, and is the starboard enabled here?
     if payload.guild_id != None and bot.config[payload.guild_id]["star_toggle"]:
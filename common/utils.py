@@ -10,6 +10,17 @@ async def proper_permissions(ctx):
     return (permissions.administrator or permissions.manage_guild
     or ctx.guild.owner_id == ctx.author.id)
 
+async def fetch_message(bot, channel, message_id, fresh = False):
+    # fetches a message, using the message cache if possible. fresh skips the cache, but still updates it
+    if not fresh:
+        mes = bot.message_cache.get(message_id)
+        if mes != None:
+            return mes
+
+    mes = await channel.fetch_message(message_id)
+    bot.message_cache.put(mes)
+    return mes
+
 async def fetch_needed(bot, payload):
     # fetches info from payload
     guild = bot.get_guild(payload.guild_id)
@@ -19,7 +30,7 @@ async def fetch_needed(bot, payload):
         user = await guild.fetch_member(payload.user_id)
 
     channel = bot.get_channel(payload.channel_id)
-    mes = await channel.fetch_message(payload.message_id)
+    mes = await fetch_message(bot, channel, payload.message_id)
 
     return user, channel, mes
 
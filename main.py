@@ -1,6 +1,7 @@
 #!/usr/bin/env python3.7
-import discord, os, asyncio
-import websockets, logging, aiohttp
+import discord, os, asyncio, time
+import collections
+import websockets, logging
 from discord.ext import commands
 from discord.ext.commands.bot import _default as bot_default
 from datetime import datetime
@@ -51,6 +52,7 @@ class SeraphimBot(commands.Bot):
     def __init__(self, command_prefix, help_command=bot_default, description=None, **options):
         super().__init__(command_prefix, help_command=help_command, description=description, **options)
         self._checks.append(global_checks)
+        self.start_time = time.perf_counter()
 
     # methods for updating the custom cache, which is explained a bit more down below
     def get_members(self, guild_id: int):
@@ -59,24 +61,72 @@ class SeraphimBot(commands.Bot):
         except KeyError:
             return None
 
+    def get_user_guilds(self, user_id: int):
+        # the ids of the guilds in the custom cache that the user is in
+        return self.user_guilds.get(user_id, set())
+
     def update_member(self, member: discord.Member):
         try:
             self.custom_cache[member.guild.id][member.id] = member
         except KeyError:
             pass
+        else:
+            self.user_guilds.setdefault(member.id, set()).add(member.guild.id)
 
     def remove_member(self, member: discord.Member):
         try:
             del self.custom_cache[member.guild.id][member.id]
         except KeyError:
             pass
+        else:
+            guild_ids = self.user_guilds.get(member.id)
+            if guild_ids != None:
+                guild_ids.discard(member.guild.id)
+                if not guild_ids:
+                    del self.user_guilds[member.id]
+
+    async def timed(self, name, coro):
+        # runs a startup phase, logging how long it took
+        start = time.perf_counter()
+        result = await coro
+        logging.info(f"Startup phase {name} took {time.perf_counter() - start:.3f}s.")
+        return result
+
+    async def load_database(self):
+        self.load_extension("cogs.db_handler")
+        await self.get_cog("DBHandler").ready.wait()
+
+    async def fetch_owner(self):
+        application = await self.application_info()
+        self.owner = application.owner
+
+    async def build_member_cache(self):
+        """Okay, let me explain myself here.
+        Basically, on every disconnect, for some reason, discord.py decides to throw away
+        every single member object it has if you don't have presences on.
+        What I'm doing here is storing a copy of that member cache, and then giving it back
+        to the bot after a disconnect. There's a better method, I know, but I don't have
+        the experience to code something more advanced.
+        While connected, the copy just points to the same member objects discord.py has, so it costs next to nothing.
+        On a disconnect, they're turned into snapshots (see MemberSnapshot), as those are a lot smaller than
+        the members that discord.py is about to throw away. See tests/member_cache_benchmark.py for numbers."""
+        self.custom_cache = {}
+        self.user_guilds = {} # user id -> ids of guilds they're in, so that user updates don't go through every guild
+        for guild in self.guilds:
+            self.custom_cache[guild.id] = {}
+            for member in guild.members:
+                self.update_member(member)
 
     async def on_ready(self):
         if self.init_load == True:
             self.starboard = star_classes.StarboardEntries()
             self.config = {}
 
-            self.star_queue = custom_classes.SetAsyncQueue()
+            self.star_queue = custom_classes.SetAsyncQueue(group_key=lambda item: item[2]) # grouped by guild id, for fairness
+            self.message_cache = custom_classes.MessageCache()
+            self.star_locks = custom_classes.KeyedLock() # ori_mes_id -> lock, so that an entry is only changed by one thing at a time
+            self.star_refresher = custom_classes.CoalescingScheduler(2, self.loop, on_error=lambda e: utils.error_handle(self, e))
+            self.metrics = collections.Counter() # miscellaneous counters, viewable with the metrics command
 
             self.snipes = {
                 "deletes": {},
@@ -87,36 +137,18 @@ class SeraphimBot(commands.Bot):
             image_endings = ("jpg", "jpeg", "png", "gif", "webp")
             self.image_extensions = tuple(image_endings) # no idea why I have to do this
 
-            application = await self.application_info()
-            self.owner = application.owner
-
             # is this overboard for a joke? yes.
-            self.death_messages = []
-            mc_en_us_url = "https://raw.githubusercontent.com/InventivetalentDev/minecraft-assets/1.16.5/assets/minecraft/lang/en_us.json"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(mc_en_us_url) as resp:
-                    mc_en_us_config = await resp.json(content_type='text/plain')
-
-                    for key, value in mc_en_us_config.items():
-                        if key.startswith("death.") and key not in ("death.attack.message_too_long", "death.attack.badRespawnPoint.link"):
-                            self.death_messages.append(value)
-
-            """Okay, let me explain myself here.
-            Basically, on every disconnect, for some reason, discord.py decides to throw away
-            every single member object it has if you don't have presences on.
-            What I'm doing here is storing a copy of that member cache, and then giving it back
-            to the bot after a disconnect. There's a better method, I know, but I don't have
-            the experience to code something more advanced."""
-            self.custom_cache = {}
-            for guild in self.guilds:
-                self.custom_cache[guild.id] = {}
-                for member in guild.members:
-                    self.update_member(member)
+            self.death_messages = custom_classes.DeathMessages(os.environ.get("DEATH_MESSAGES_PATH", "death_messages.txt"), self.loop)
+            self.death_messages.prepare()
 
             self.load_extension("jishaku")
-            self.load_extension("cogs.db_handler")
-            while self.config == {}:
-                await asyncio.sleep(0.1)
+
+            # none of these depend on each other, so they can all run at once
+            await asyncio.gather(
+                self.timed("database", self.load_database()),
+                self.timed("application info", self.fetch_owner()),
+                self.timed("member cache", self.build_member_cache())
+            )
 
             cogs_list = utils.get_all_extensions(os.environ.get("DIRECTORY_OF_FILE"))
 
@@ -128,14 +160,31 @@ class SeraphimBot(commands.Bot):
                         pass
 
             await bot.slash.register_all_commands()
+            logging.info(f"Ready {time.perf_counter() - self.start_time:.3f}s after starting up.")
         else:
             for guild in self.guilds:
-                members = guild.members
-                cache_members = self.get_members(guild.id)
-                non_cache_members = [m for m in cache_members if not m in members]
+                start = time.perf_counter()
+
+                cache_members = self.custom_cache.get(guild.id)
+                if cache_members == None:
+                    continue
+
+                # comparing by id with a set keeps this linear - big guilds would freeze the bot otherwise
+                member_ids = {m.id for m in guild.members}
+                non_cache_members = [m for m_id, m in cache_members.items() if not m_id in member_ids]
                 for non_cache_member in non_cache_members:
+                    if isinstance(non_cache_member, custom_classes.MemberSnapshot):
+                        non_cache_member = non_cache_member.to_member(guild)
                     guild._add_member(non_cache_member) # dirty, but it has to be done
 
+                # back to pointing at the live members, now that there are some again
+                self.custom_cache[guild.id] = {m.id: m for m in guild.members}
+
+                logging.info(f"Restored {len(non_cache_members)} members to {guild.id} in {time.perf_counter() - start:.3f}s.")
+
+                # lets the heartbeat and such go through between guilds
+                await asyncio.sleep(0)
+
         utcnow = datetime.utcnow()
         time_format = utcnow.strftime("%x %X UTC")
 
@@ -151,6 +200,17 @@ class SeraphimBot(commands.Bot):
         except websockets.ConnectionClosedOK:
             await utils.msg_to_owner(self, "Reconnecting...")
 
+    async def on_disconnect(self):
+        if self.init_load == True:
+            return
+
+        # discord.py throws away its members once it reconnects, so we only keep what's needed to rebuild them
+        # this can run a few times before reconnecting, so members that are already snapshots are left alone
+        for cache_members in self.custom_cache.values():
+            for member_id, member in cache_members.items():
+                if isinstance(member, discord.Member):
+                    cache_members[member_id] = custom_classes.MemberSnapshot(member)
+
     async def on_resumed(self):
         activity = discord.Activity(name = 'over a couple of servers', type = discord.ActivityType.watching)
         await self.change_presence(activity = activity)
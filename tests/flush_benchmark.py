@@ -0,0 +1,96 @@
+#!/usr/bin/env python3.7
+"""Benchmark for flushing starboard changes: the old one query per row loop vs the batched DBHandler.run_commands.
+
+For each amount of changes, seeds a starboard table with entries, changes half of them and makes as many new ones,
+and times how long each way takes to write those changes.
+Needs DB_URL to point at a database with an empty (or no) starboard table, as the rows it makes are deleted afterwards.
+Run with DB_URL=postgres://... python tests/flush_benchmark.py [amount of changes...]."""
+import asyncio, sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cogs.db_handler as db_handler
+import common.star_classes as star_classes
+
+CHANGE_AMOUNTS = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 5000]
+REACTORS_PER_ENTRY = 20
+
+class BenchHandler():
+    """Just enough of DBHandler for run_commands to work."""
+    init_connection = db_handler.DBHandler.init_connection
+    get_pool = db_handler.DBHandler.get_pool
+    run_commands = db_handler.DBHandler.run_commands
+
+    def __init__(self):
+        self.pool = None
+        self.reactor_table = False
+
+async def old_run_commands(handler: BenchHandler, commands):
+    # how run_commands used to work, but with the pool so that only the queries are compared
+    pool = await handler.get_pool()
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            for command in commands:
+                if command["type"] == "DELETE FROM":
+                    await conn.execute("DELETE FROM starboard WHERE ori_mes_id = $1", command["entry"])
+                    continue
+                elif command["type"] == "INSERT INTO":
+                    db_command = "INSERT INTO starboard(ori_mes_id, data) VALUES($1, $2)"
+                elif command["type"] == "UPDATE":
+                    db_command = "UPDATE starboard SET data = $2 WHERE ori_mes_id = $1"
+
+                await conn.execute(db_command, command["entry"].ori_mes_id, command["entry"].to_dict())
+
+def make_entry(ori_mes_id):
+    reactors = range(ori_mes_id * 100, ori_mes_id * 100 + REACTORS_PER_ENTRY)
+    return star_classes.StarboardEntry(ori_mes_id, 1, None, None, 2, reactors, (), 3, False, False, False)
+
+async def seed(handler: BenchHandler, amount):
+    # half of the changes are to existing entries, and half are new entries
+    pool = await handler.get_pool()
+    existing = [make_entry(ori_mes_id) for ori_mes_id in range(1, amount // 2 + 1)]
+
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM starboard")
+        await conn.executemany("INSERT INTO starboard(ori_mes_id, data) VALUES($1, $2)",
+            [(entry.ori_mes_id, entry.to_dict()) for entry in existing])
+
+    commands = []
+    for entry in existing:
+        entry.add_reactor(1, star_classes.ReactorType.ORI_REACTORS)
+        commands.append({"table": "starboard", "type": "UPDATE", "entry": entry})
+    for ori_mes_id in range(amount // 2 + 1, amount + 1):
+        commands.append({"table": "starboard", "type": "INSERT INTO", "entry": make_entry(ori_mes_id)})
+
+    return commands
+
+async def time_flush(handler: BenchHandler, run, amount):
+    commands = await seed(handler, amount)
+    start = time.perf_counter()
+    await run(commands)
+    return time.perf_counter() - start
+
+async def main():
+    handler = BenchHandler()
+    pool = await handler.get_pool()
+
+    async with pool.acquire() as conn:
+        await conn.execute("CREATE TABLE IF NOT EXISTS starboard(ori_mes_id bigint PRIMARY KEY, data jsonb)")
+        if await conn.fetchval("SELECT count(*) FROM starboard"):
+            print("The starboard table has rows in it already. Use a database that doesn't have anything important in it.")
+            return
+
+    try:
+        print(f"Flushing changes to entries with {REACTORS_PER_ENTRY} reactors each:")
+        for amount in CHANGE_AMOUNTS:
+            old_time = await time_flush(handler, lambda commands: old_run_commands(handler, commands), amount)
+            new_time = await time_flush(handler, handler.run_commands, amount)
+            print(f"  {amount} changes: per row {old_time * 1000:.1f} ms, batched {new_time * 1000:.1f} ms " +
+                f"({old_time / new_time:.1f}x faster)")
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM starboard")
+        await pool.close()
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3.7
+"""Memory benchmark for the custom member cache (see SeraphimBot.build_member_cache).
+
+Makes a guild with a lot of synthetic members using discord.py's own Member class, and measures with tracemalloc
+how much the custom cache costs on top of discord.py's cache, both while connected and after a disconnect
+(where discord.py has thrown its members away, and the custom cache is the only thing keeping them).
+Storing references to the live members, storing MemberSnapshots, and snapshotting the live members
+only when disconnecting (what the bot does) are compared.
+Run with python tests/member_cache_benchmark.py [member count]."""
+import asyncio, gc, random, sys, os, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord, discord.state
+
+import common.classes as custom_classes
+
+NUM_MEMBERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+NUM_ROLES = 50
+
+def make_guild(loop):
+    state = discord.state.ConnectionState(dispatch=lambda *args: None, handlers={}, hooks={},
+        syncer=None, http=None, loop=loop)
+    return discord.Guild(data={"id": 1, "name": "benchmark", "member_count": NUM_MEMBERS}, state=state)
+
+def add_members(guild: discord.Guild):
+    rng = random.Random(0)
+    for member_id in range(100000000000000000, 100000000000000000 + NUM_MEMBERS):
+        data = {
+            "user": {
+                "id": member_id,
+                "username": f"user{member_id % 100000}",
+                "discriminator": f"{member_id % 10000:04}",
+                "avatar": None,
+                "bot": False
+            },
+            "roles": [str(rng.randrange(NUM_ROLES)) for _ in range(rng.randrange(4))],
+            "nick": None,
+            "joined_at": "2021-01-01T00:00:00+00:00"
+        }
+        guild._add_member(discord.Member(data=data, guild=guild, state=guild._state))
+
+def snapshot_members(cache):
+    # snapshots anything that's still a live member, like on_disconnect does
+    for member_id, member in cache.items():
+        if isinstance(member, discord.Member):
+            cache[member_id] = custom_classes.MemberSnapshot(member)
+
+def measure(make_cache, on_disconnect, loop):
+    """Returns how much memory the cache costs on top of discord.py's members while connected,
+    and how much it keeps alive by itself once discord.py has thrown its members away."""
+    guild = make_guild(loop)
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+
+    add_members(guild)
+    gc.collect()
+    before_cache = tracemalloc.get_traced_memory()[0]
+
+    cache = make_cache(guild)
+    gc.collect()
+    connected = tracemalloc.get_traced_memory()[0] - before_cache
+
+    # what discord.py does to a guild's members on a disconnect without presences
+    guild._members.clear()
+    guild._state._users.clear()
+    on_disconnect(cache)
+    gc.collect()
+    disconnected = tracemalloc.get_traced_memory()[0] - start
+
+    tracemalloc.stop()
+    assert len(cache) == NUM_MEMBERS
+    return connected, disconnected
+
+def main():
+    loop = asyncio.new_event_loop()
+    mib = 2 ** 20
+
+    strategies = (
+        ("live members, kept as is after disconnecting", lambda guild: {m.id: m for m in guild.members}, lambda cache: None),
+        ("snapshots all the time", lambda guild: {m.id: custom_classes.MemberSnapshot(m) for m in guild.members}, lambda cache: None),
+        ("live members, snapshotted on disconnect", lambda guild: {m.id: m for m in guild.members}, snapshot_members),
+    )
+
+    print(f"{NUM_MEMBERS} members, memory used by the custom cache:")
+    for name, make_cache, on_disconnect in strategies:
+        connected, disconnected = measure(make_cache, on_disconnect, loop)
+        print(f"  {name}:")
+        print(f"    connected (on top of discord.py's cache): {connected / mib:.1f} MiB")
+        print(f"    after disconnecting:                      {disconnected / mib:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
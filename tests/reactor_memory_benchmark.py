@@ -0,0 +1,50 @@
+#!/usr/bin/env python3.7
+"""Memory benchmark for starboard reactor storage: plain sets vs CompactReactors.
+
+Makes 1M synthetic snowflake reactor IDs spread over 1000 entries, like they'd be when loaded from the database,
+and measures how much memory each way of storing them uses with tracemalloc.
+Run with python tests/reactor_memory_benchmark.py."""
+import random, sys, os, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common.star_classes as star_classes
+
+NUM_REACTORS = 1000000
+NUM_ENTRIES = 1000
+PER_ENTRY = NUM_REACTORS // NUM_ENTRIES
+
+def reactor_ids(seed):
+    # new int objects every time, as rows from the database would give us
+    rng = random.Random(seed)
+    return [rng.randrange(100000000000000000, 900000000000000000) for _ in range(PER_ENTRY)]
+
+def measure(make_container):
+    tracemalloc.start()
+    containers = [make_container(reactor_ids(i)) for i in range(NUM_ENTRIES)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert sum(len(c) for c in containers) == NUM_REACTORS
+    return used
+
+def main():
+    # the sets keep their int objects alive, so they're counted along with the sets
+    set_total = measure(set)
+
+    # the same sets, but with the ints made beforehand, to see what the sets themselves cost
+    ids = [reactor_ids(i) for i in range(NUM_ENTRIES)]
+    tracemalloc.start()
+    sets_only = [set(entry_ids) for entry_ids in ids]
+    set_only = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sets_only, ids
+
+    compact_total = measure(star_classes.CompactReactors)
+
+    mib = 2 ** 20
+    print(f"{NUM_REACTORS} reactors over {NUM_ENTRIES} entries:")
+    print(f"  set:             {set_total / mib:.1f} MiB ({set_only / mib:.1f} MiB for the sets, the rest is int objects)")
+    print(f"  CompactReactors: {compact_total / mib:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3.7
+"""Stress test for the per-entry starboard locks.
+
+Fires thousands of star reactions at the real Star cog all at once, through on_raw_reaction_add and on_raw_reaction_remove,
+with the cog's own queue workers posting entries. Only Discord is faked: the bot is a fake one, and fetching a message,
+the users of a reaction, or posting to the starboard takes a random amount of time.
+Afterwards, every entry must have exactly the stars it has on "Discord", and nothing can be posted twice.
+
+Run with python tests/star_locks_stress.py. Passing --no-locks swaps the locks out, which should make it fail."""
+import asyncio, random, sys, os, collections
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+
+import common.classes as custom_classes
+import common.star_classes as star_classes
+import common.star_utils as star_utils
+import common.star_mes_handler as star_mes
+import common.utils as utils
+import cogs.starboard.star_handling as star_handling
+
+NUM_MESSAGES = 25
+NUM_USERS = 400
+NUM_EVENTS = 10000
+NUM_WORKERS = 4
+STAR_LIMIT = 5
+GUILD_IDS = (1, 2, 3)
+AUTHOR_ID = 999999 # the author of every message, who never stars anything
+
+class NoLock():
+    # used with --no-locks, to show that the test catches what the locks prevent
+    def __call__(self, key):
+        return self
+
+    def __len__(self):
+        return 0
+
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+async def api_delay():
+    await asyncio.sleep(random.random() / 500)
+
+class FakeUser():
+    def __init__(self, user_id):
+        self.id = user_id
+        self.bot = False
+
+class FakeReactionUsers():
+    def __init__(self, bot, mes_id):
+        self.bot = bot
+        self.mes_id = mes_id
+
+    async def flatten(self):
+        await api_delay()
+        return [FakeUser(user_id) for user_id in self.bot.stars[self.mes_id]]
+
+class FakeReaction():
+    def __init__(self, bot, mes_id):
+        self.bot = bot
+        self.mes_id = mes_id
+
+    def __str__(self):
+        return "⭐"
+
+    def users(self):
+        return FakeReactionUsers(self.bot, self.mes_id)
+
+class FakeGuild():
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.members = []
+
+    def get_member(self, user_id):
+        return FakeUser(user_id)
+
+class FakeChannel():
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+
+class FakeMessage():
+    def __init__(self, bot, channel, mes_id):
+        self.id = mes_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = FakeUser(AUTHOR_ID)
+        self.embeds = []
+        self.reactions = [FakeReaction(bot, mes_id)]
+
+class FakeBot():
+    """Just enough of the bot for the Star cog, which also plays the part of Discord."""
+    def __init__(self, loop, use_locks):
+        self.loop = loop
+        self.user = FakeUser(0)
+
+        self.starboard = star_classes.StarboardEntries()
+        self.star_locks = custom_classes.KeyedLock() if use_locks else NoLock()
+        self.star_queue = custom_classes.SetAsyncQueue(group_key=lambda item: item[2])
+        self.message_cache = custom_classes.MessageCache()
+        self.metrics = collections.Counter()
+        self.star_refresher = custom_classes.CoalescingScheduler(0.01, loop, on_error=self.record_error)
+
+        self.config = {}
+        self.guilds = {}
+        self.channels = {}
+        for guild_id in GUILD_IDS:
+            guild = FakeGuild(guild_id)
+            self.guilds[guild_id] = guild
+            self.channels[self.message_channel_id(guild_id)] = FakeChannel(self.message_channel_id(guild_id), guild)
+            self.channels[self.starboard_id(guild_id)] = FakeChannel(self.starboard_id(guild_id), guild)
+
+            self.config[guild_id] = {
+                "starboard_id": self.starboard_id(guild_id),
+                "star_limit": STAR_LIMIT,
+                "star_blacklist": [],
+                "star_toggle": True,
+                "remove_reaction": False
+            }
+
+        # what "Discord" has
+        self.stars = collections.defaultdict(set) # mes_id -> the users starring it
+        self.posts = collections.Counter() # mes_id -> how many times it was posted to the starboard
+        self.next_var_id = 100000
+        self.refreshes = 0
+        self.errors = []
+
+    @staticmethod
+    def message_channel_id(guild_id):
+        return guild_id * 10
+
+    @staticmethod
+    def starboard_id(guild_id):
+        return guild_id * 10 + 1
+
+    @staticmethod
+    def guild_of(mes_id):
+        return GUILD_IDS[mes_id % len(GUILD_IDS)]
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def record_error(self, error, ctx = None):
+        self.errors.append(error)
+
+async def fake_fetch_message(bot, channel, message_id, fresh = False):
+    await api_delay()
+    return FakeMessage(bot, channel, message_id)
+
+async def fake_fetch_needed(bot, payload):
+    channel = bot.get_channel(payload.channel_id)
+    mes = await utils.fetch_message(bot, channel, payload.message_id)
+    return bot.get_guild(payload.guild_id).get_member(payload.user_id), channel, mes
+
+async def fake_send(bot, mes):
+    # what star_mes.send does to the entry, without making an embed
+    await api_delay()
+    starboard_entry = await bot.starboard.fetch(mes.id, mes.guild.id)
+
+    bot.posts[mes.id] += 1
+    bot.next_var_id += 1
+    starboard_entry.star_var_id = bot.next_var_id
+    starboard_entry.starboard_id = bot.config[mes.guild.id]["starboard_id"]
+    bot.starboard.update(starboard_entry)
+
+async def fake_star_entry_refresh(bot, starboard_entry, guild_id):
+    await api_delay()
+    bot.refreshes += 1
+
+def patch_discord_calls(bot):
+    utils.fetch_message = fake_fetch_message
+    utils.fetch_needed = fake_fetch_needed
+    utils.error_handle = bot.record_error
+    star_mes.send = fake_send
+    star_utils.star_entry_refresh = fake_star_entry_refresh
+
+def make_payload(bot, mes_id, user_id, adding):
+    guild_id = bot.guild_of(mes_id)
+    data = {
+        "message_id": mes_id,
+        "channel_id": bot.message_channel_id(guild_id),
+        "user_id": user_id,
+        "guild_id": guild_id
+    }
+
+    payload = discord.RawReactionActionEvent(data, discord.PartialEmoji(name="⭐"),
+        "REACTION_ADD" if adding else "REACTION_REMOVE")
+    if adding:
+        payload.member = FakeUser(user_id)
+    return payload
+
+async def fire_events(bot, star_cog):
+    # each user alternates between adding and removing their star on a message, as that's all discord allows
+    # the events are handled in the order they're fired, as the locks are first come, first served
+    tasks = []
+
+    for i in range(NUM_EVENTS):
+        mes_id = random.randint(1, NUM_MESSAGES)
+        user_id = random.randint(1, NUM_USERS)
+        adding = not user_id in bot.stars[mes_id]
+
+        if adding:
+            bot.stars[mes_id].add(user_id)
+            listener = star_cog.on_raw_reaction_add
+        else:
+            bot.stars[mes_id].discard(user_id)
+            listener = star_cog.on_raw_reaction_remove
+        tasks.append(asyncio.ensure_future(listener(make_payload(bot, mes_id, user_id, adding))))
+
+        if i % 50 == 0:
+            # lets the handlers get going, so the stars on "Discord" change while they're running
+            await asyncio.sleep(0)
+
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+async def wait_until_idle(bot):
+    # join can't be used, as the queue throws away duplicates without counting them as done
+    idle_checks = 0
+    while idle_checks < 3:
+        await asyncio.sleep(0.01)
+        if bot.star_queue.empty() and not len(bot.star_locks) and not bot.star_refresher.tasks:
+            idle_checks += 1
+        else:
+            idle_checks = 0
+
+async def run(use_locks):
+    bot = FakeBot(asyncio.get_event_loop(), use_locks)
+    patch_discord_calls(bot)
+
+    os.environ["STAR_QUEUE_WORKERS"] = str(NUM_WORKERS)
+    star_cog = star_handling.Star(bot)
+
+    try:
+        results = await fire_events(bot, star_cog)
+        await wait_until_idle(bot)
+    finally:
+        star_cog.cog_unload()
+
+    failures = [f"listener raised {e!r}" for e in results if isinstance(e, Exception)]
+    failures.extend(f"worker or refresh raised {e!r}" for e in bot.errors)
+
+    for mes_id in range(1, NUM_MESSAGES + 1):
+        expected = bot.stars[mes_id]
+        entry = bot.starboard.get(mes_id)
+        stars = entry.unique_stars if entry else 0
+        reactors = set(entry.ori_reactors) if entry else set()
+
+        if reactors != expected or stars != len(expected):
+            failures.append(f"entry {mes_id}: {stars} stars, expected {len(expected)}")
+        if bot.posts[mes_id] > 1:
+            failures.append(f"entry {mes_id}: posted {bot.posts[mes_id]} times")
+        if stars >= STAR_LIMIT and not bot.posts[mes_id]:
+            failures.append(f"entry {mes_id}: has {stars} stars, but was never posted")
+
+    if use_locks and len(bot.star_locks) != 0:
+        failures.append(f"{len(bot.star_locks)} locks were left behind")
+
+    return bot, failures
+
+def main():
+    use_locks = not "--no-locks" in sys.argv
+    bot, failures = asyncio.get_event_loop().run_until_complete(run(use_locks))
+
+    if failures:
+        print("\n".join(failures[:50]))
+        print(f"FAILED: {len(failures)} problems with {NUM_EVENTS} reactions.")
+        sys.exit(1)
+
+    print(f"OK: {NUM_EVENTS} concurrent reactions over {NUM_MESSAGES} entries, all counts correct, nothing posted twice. " +
+        f"{sum(bot.posts.values())} posts, {bot.refreshes} refreshes, {bot.metrics['star_reactions_skipped']} reactions skipped.")
+
+if __name__ == "__main__":
+    main()